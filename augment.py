@@ -0,0 +1,90 @@
+import tensorflow as tf
+from keras.layers import Layer
+from keras import backend as K
+
+
+def d4_transform(patch, k, inverse=False):
+    """
+    Same transformations as gen_patches.d4_view on a tensor of shape (sz, sz, channels): bit 0 of k flips the rows,
+    bit 1 the columns and bit 2 swaps the two axes.
+    :param k: scalar int32 tensor in [0, 8)
+    :param inverse: apply the inverse transformation, the swap first and then the flips
+    """
+    def flip_rows(p):
+        return tf.cond(tf.equal(k % 2, 1), lambda: tf.reverse(p, [0]), lambda: p)
+
+    def flip_cols(p):
+        return tf.cond(tf.equal(k // 2 % 2, 1), lambda: tf.reverse(p, [1]), lambda: p)
+
+    def swap(p):
+        return tf.cond(tf.equal(k // 4, 1), lambda: tf.transpose(p, [1, 0, 2]), lambda: p)
+
+    if inverse:
+        return flip_cols(flip_rows(swap(patch)))
+    return swap(flip_cols(flip_rows(patch)))
+
+
+def d4_batch(batch, ks, inverse=False):
+    return tf.map_fn(lambda args: d4_transform(args[0], args[1], inverse), (batch, ks), dtype=batch.dtype)
+
+
+class RandomD4(Layer):
+    """
+    Draws a D4 transformation (int32 in [0, 8)) for every sample of the batch of its input, to be shared by the
+    D4Transform layers that must stay in sync.
+    """
+
+    def call(self, inputs, **kwargs):
+        return tf.random.uniform(tf.shape(inputs)[:1], 0, 8, dtype='int32')
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0],)
+
+
+class D4Transform(Layer):
+    """
+    Applies to [x, ks] the D4 transformations ks drawn by RandomD4, only in the training phase.
+    :param inverse: undo the transformations, for the outputs of a model whose inputs were transformed
+    """
+
+    def __init__(self, inverse=False, **kwargs):
+        super(D4Transform, self).__init__(**kwargs)
+        self.inverse = inverse
+
+    def call(self, inputs, training=None):
+        x, ks = inputs
+        return K.in_train_phase(lambda: d4_batch(x, ks, self.inverse), x, training=training)
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0]
+
+    def get_config(self):
+        config = {'inverse': self.inverse}
+        base_config = super(D4Transform, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class BrightnessJitter(Layer):
+    """
+    Scales every sample of the batch by a factor drawn uniformly in [1 - max_delta, 1 + max_delta] and clips to
+    [0, 1], only in the training phase. Replaces the brightness_augment of gen_patches.py for inputs in [0, 1].
+    """
+
+    def __init__(self, max_delta=0.1, **kwargs):
+        super(BrightnessJitter, self).__init__(**kwargs)
+        self.max_delta = max_delta
+
+    def call(self, inputs, training=None):
+        def jitter():
+            factor = tf.random.uniform(tf.stack([tf.shape(inputs)[0], 1, 1, 1]), 1. - self.max_delta,
+                                       1. + self.max_delta, dtype=inputs.dtype)
+            return K.clip(inputs * factor, 0., 1.)
+        return K.in_train_phase(jitter, inputs, training=training)
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = {'max_delta': self.max_delta}
+        base_config = super(BrightnessJitter, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
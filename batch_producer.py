@@ -0,0 +1,117 @@
+import multiprocessing as mp
+import queue
+import traceback
+import numpy as np
+from generator import image_generator, val_generator
+from val_shards import shard_val_generator
+import manifest
+
+# seconds between two checks that the workers are alive while waiting for a batch
+POLL_SECONDS = 5
+
+
+def _slot_views(buffers, shapes, dtypes, n_slots):
+    return [np.frombuffer(buffer, dtype=dtype).reshape((n_slots,) + shape)
+            for buffer, shape, dtype in zip(buffers, shapes, dtypes)]
+
+
+def _worker(gen_fn, args, kwargs, buffers, shapes, dtypes, n_slots, free_slots, ready_slots):
+    views = _slot_views(buffers, shapes, dtypes, n_slots)
+    try:
+        for batch_x, (batch_y, batch_y2) in gen_fn(*args, **kwargs):
+            slot = free_slots.get()
+            for view, batch in zip(views, (batch_x, batch_y, batch_y2)):
+                view[slot] = batch
+            ready_slots.put(slot)
+    except Exception:
+        # the traceback goes to the parent instead of the slot index, it raises it
+        ready_slots.put(traceback.format_exc())
+
+
+def parallel_generator(gen_fn, args, workers_kwargs, n_slots=None):
+    """
+    Runs one gen_fn per worker process and hands the batches over through a ring of slots in shared memory, only the
+    slot indices go through the queues. An exception of a worker, or a worker dying, raises a RuntimeError in the
+    parent instead of blocking it.
+    :param gen_fn: generator function yielding (batch_x, [batch_y, batch_y2]) with fixed shapes
+    :param args: positional arguments of gen_fn, the same for every worker
+    :param workers_kwargs: list with the keyword arguments of gen_fn for each worker
+    :param n_slots: number of batches in the ring, defaults to twice the number of workers
+    """
+    n_workers = len(workers_kwargs)
+    if n_slots is None:
+        n_slots = 2 * n_workers
+    # probe the shapes of the batches with a generator of the main process
+    batch_x, (batch_y, batch_y2) = next(gen_fn(*args, **workers_kwargs[0]))
+    probe = (batch_x, batch_y, batch_y2)
+    shapes = [b.shape for b in probe]
+    dtypes = [b.dtype for b in probe]
+    buffers = [mp.RawArray('b', n_slots * b.nbytes) for b in probe]
+    views = _slot_views(buffers, shapes, dtypes, n_slots)
+
+    free_slots = mp.Queue()
+    ready_slots = mp.Queue()
+    for slot in range(n_slots):
+        free_slots.put(slot)
+    processes = []
+    for kwargs in workers_kwargs:
+        p = mp.Process(target=_worker, args=(gen_fn, args, kwargs, buffers, shapes, dtypes, n_slots,
+                                             free_slots, ready_slots))
+        p.daemon = True
+        p.start()
+        processes.append(p)
+
+    try:
+        while True:
+            try:
+                slot = ready_slots.get(timeout = POLL_SECONDS)
+            except queue.Empty:
+                # a worker killed without a traceback, e.g. out of memory
+                for p in processes:
+                    if not p.is_alive():
+                        raise RuntimeError('batch worker {} exited with code {}'.format(p.pid, p.exitcode))
+                continue
+            if isinstance(slot, str):
+                raise RuntimeError('a batch worker failed:\n' + slot)
+            # copy out of the slot, keras keeps the batches in its own queue
+            batch_x, batch_y, batch_y2 = [np.array(view[slot]) for view in views]
+            free_slots.put(slot)
+            yield (batch_x, [batch_y, batch_y2])
+    finally:
+        for p in processes:
+            p.terminate()
+
+
+def parallel_image_generator(ids_file, path_image, path_mask, path_full_img, files_weights, batch_size = 5,
+                             patch_size = 160, reader = 'tiff', n_workers = 4, n_slots = None, cache_bytes = None,
+                             cache_reuse = None, seed = 0, initial_step = 0, class_weights = None, augment = True,
+                             min_valid = None, mask_format = 'onehot', n_classes = None, boundary_radius = None):
+    if files_weights is None:
+        # read once here rather than by every worker
+        files_weights = manifest.files_weights(path_image, ids_file)
+    args = (ids_file, path_image, path_mask, path_full_img, files_weights, batch_size, patch_size, reader)
+    # every worker keeps its own cache, the budget is split between them
+    if cache_bytes is not None:
+        cache_bytes //= n_workers
+    workers_kwargs = [{'seed': seed, 'initial_step': initial_step + w, 'step_stride': n_workers,
+                       'cache_bytes': cache_bytes, 'cache_reuse': cache_reuse, 'class_weights': class_weights,
+                       'augment': augment, 'min_valid': min_valid, 'mask_format': mask_format,
+                       'n_classes': n_classes, 'boundary_radius': boundary_radius}
+                      for w in range(n_workers)]
+    return parallel_generator(image_generator, args, workers_kwargs, n_slots)
+
+
+def parallel_val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = 5, n_workers = 4,
+                           n_slots = None, mask_format = 'onehot', n_classes = None):
+    args = (path_patch_img, path_patch_full_img, path_patch_mask, batch_size)
+    workers_kwargs = [{'shard': w, 'n_shards': n_workers, 'mask_format': mask_format, 'n_classes': n_classes}
+                      for w in range(n_workers)]
+    return parallel_generator(val_generator, args, workers_kwargs, n_slots)
+
+
+def parallel_shard_val_generator(path_shards, batch_size = 5, n_workers = 4, n_slots = None, mask_format = 'onehot',
+                                 n_classes = None):
+    # each worker streams a contiguous part of the memory-mapped shards
+    workers_kwargs = [{'shard': w, 'n_shards': n_workers, 'mask_format': mask_format, 'n_classes': n_classes}
+                      for w in range(n_workers)]
+    return parallel_generator(shard_val_generator, (path_shards, batch_size), workers_kwargs, n_slots)
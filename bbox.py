@@ -2,12 +2,20 @@ from collections import defaultdict
 import csv
 import sys
 import os
+from multiprocessing import Pool
 import cv2
 from shapely.geometry import MultiPolygon, Polygon
 import shapely.wkt
 import shapely.affinity
 import numpy as np
 import tifffile as tiff
+from dstl_index import load_index
+from mask_format import to_soft
+
+N_LABELS = 7
+N_WORKERS = 8
+# 'soft' writes the fractions as uint8 fixed point, 8 times smaller than float64 (see mask_format.py)
+MASK_FORMAT = 'onehot'
 
 
 def listdir_nohidden(path):
@@ -33,9 +41,6 @@ def map_labels(old_label):
         return -1
 
 
-csv.field_size_limit(sys.maxsize);
-
-
 def get_scalers(img_size, x_m, y_m):
     h, w = img_size  # they are flipped so that mask_for_polygons works correctly
     w_ = w * (w / (w + 1))
@@ -56,44 +61,52 @@ def mask_for_polygons(polygons, img_size):
     return img_mask
 
 
-path = '/home/mdias/datasets/dstl-satellite-imagery-feature-detection/'
-image_ids = list(listdir_nohidden(path + 'train_geojson_v3/'))
-poly_types = list(range(1, 11))
-poly_types = [str(i) for i in poly_types]
-
-for IM_ID in image_ids:
-    # Read image with tiff
-    im_rgb = tiff.imread(path + 'three_band/{}.tif'.format(IM_ID)).transpose([1,2,0])
-    im_size = im_rgb.shape[:2]
-    mask = np.zeros(shape = (7, im_size[0], im_size[1]))
-    for POLY_TYPE in poly_types:
-        # Load grid size
-        x_max = y_min = None
-        for _im_id, _x, _y in csv.reader(open(path + 'grid_sizes.csv')):
-            if _im_id == IM_ID:
-                x_max, y_min = float(_x), float(_y)
-                break
-
-        # Load train poly with shapely
-        train_polygons = None
-        for _im_id, _poly_type, _poly in csv.reader(open(path + 'train_wkt_v4.csv')):
-            if _im_id == IM_ID and _poly_type == POLY_TYPE:
-                train_polygons = shapely.wkt.loads(_poly)
-                break
-
-        x_scaler, y_scaler = get_scalers(im_size, x_max, y_min)
+def image_mask(im_size, grid_size, polygons, label_fn=map_labels, n_labels=N_LABELS):
+    """
+    Soft mask of an image, the classes of a pixel covered by several classes share it, the last class is the
+    background of the pixels of no class.
+    :param grid_size: (x_max, y_min) of the image from grid_sizes.csv
+    :param polygons: dict from the polygon types to their WKT
+    :return: ndarray with shape (x_sz, y_sz, n_labels)
+    """
+    x_scaler, y_scaler = get_scalers(im_size, *grid_size)
+    mask = np.zeros((n_labels, im_size[0], im_size[1]), dtype='uint8')
+    for poly_type, wkt in sorted(polygons.items()):
+        label = label_fn(poly_type)
+        train_polygons = shapely.wkt.loads(wkt)
         train_polygons_scaled = shapely.affinity.scale(train_polygons, xfact=x_scaler, yfact=y_scaler, origin=(0, 0, 0))
-        train_mask = mask_for_polygons(train_polygons_scaled, im_size)
-        mask[map_labels(POLY_TYPE)] += train_mask
-    mask = np.where(mask >= 1, 1, 0)
-    mask_count = np.sum(mask, axis=0)
-    oi = np.where(mask_count == 0, 1, 0)
-    mask[6] = oi
-    mask_count = np.sum(mask, axis=0)
-    mask = mask / mask_count
-
-    print(IM_ID)
-    mask = mask.transpose([1,2,0])
-    print(mask.shape)
-    tiff.imsave(path + 'mask_uni/{}.tif'.format(IM_ID), mask)
-
+        mask[label] |= mask_for_polygons(train_polygons_scaled, im_size)
+    mask[n_labels - 1] = mask.sum(axis=0) == 0
+    mask = mask / mask.sum(axis=0)
+    return mask.transpose([1, 2, 0])
+
+
+def rasterize(task):
+    im_id, im_path, out_path, grid_size, polygons, mask_format = task
+    # only the header of the three band image is read, for its size
+    with tiff.TiffFile(im_path) as f:
+        im_size = f.series[0].shape[1:3]
+    mask = image_mask(im_size, grid_size, polygons)
+    if mask_format == 'soft':
+        mask = to_soft(mask)
+    tiff.imsave(out_path, mask)
+    return im_id
+
+
+def main(path, image_ids=None, n_workers=N_WORKERS, mask_format=MASK_FORMAT):
+    """
+    Writes the masks of the images of path/train_geojson_v3 to path/mask_uni, rasterized by n_workers processes. The
+    csvs are parsed once, see dstl_index.py.
+    """
+    grid, wkt = load_index(path)
+    image_ids = image_ids or list(listdir_nohidden(path + 'train_geojson_v3/'))
+    if not os.path.exists(path + 'mask_uni/'): os.makedirs(path + 'mask_uni/')
+    tasks = [(im_id, path + 'three_band/{}.tif'.format(im_id), path + 'mask_uni/{}.tif'.format(im_id),
+              grid[im_id], wkt.get(im_id, {}), mask_format) for im_id in image_ids]
+    with Pool(n_workers) as pool:
+        for im_id in pool.imap_unordered(rasterize, tasks):
+            print(im_id)
+
+
+if __name__ == '__main__':
+    main('/home/mdias/datasets/dstl-satellite-imagery-feature-detection/')
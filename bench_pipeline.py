@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import tifffile as tiff
+import generator
+from generator import STATS, reset_stats
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+def process_rss(pid):
+    """
+    :return: peak resident memory of the live process pid in bytes, its current resident memory where the peak is not
+    reported, None if unknown
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        return None
+    except psutil.Error:
+        return None
+
+
+def peak_rss():
+    """
+    :return: (peak resident memory of this process, sum of the peaks of its live worker processes) in bytes, None if
+    unknown, the workers are measured before the generator stops them
+    """
+    workers = [process_rss(p.pid) for p in multiprocessing.active_children()]
+    workers = None if None in workers else sum(workers)
+    if resource is None:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset, workers
+        except (ImportError, AttributeError):
+            return None, workers
+    # kilobytes on linux, bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit, workers
+
+
+def read_bytes():
+    # bytes read by this process through read() calls, linux only
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def make_synthetic(path, n_tiles=4, tile_size=2000, patch_size=160, n_patches=50, n_classes=6, seed=0):
+    """
+    Writes random tiles and validation patches with the layout of the datasets of train_net.py.
+    :return: (path_img, path_mask, path_full_img, ids, path_patch_img, path_patch_full_img, path_patch_mask)
+    """
+    rng = np.random.RandomState(seed)
+    for d in ('img', 'mask', 'full_img', 'patch_img', 'patch_mask', 'patch_full_img'):
+        os.makedirs(os.path.join(path, d), exist_ok=True)
+    path_img = os.path.join(path, 'img', '{}.tif')
+    path_mask = os.path.join(path, 'mask', '{}.tif')
+    path_full_img = os.path.join(path, 'full_img', '{}.tif')
+    ids = [str(i) for i in range(n_tiles)]
+
+    def write(path_img, path_mask, path_full_img, size):
+        tiff.imwrite(path_img, rng.rand(size, size, 3).astype('float32'))
+        tiff.imwrite(path_mask, np.eye(n_classes, dtype='uint8')[rng.randint(n_classes, size=(size, size))])
+        tiff.imwrite(path_full_img, rng.rand(size, size, 3).astype('float32'))
+
+    for id in ids:
+        write(path_img.format(id), path_mask.format(id), path_full_img.format(id), tile_size)
+    for i in range(n_patches):
+        name = '{}.tif'.format(i)
+        write(os.path.join(path, 'patch_img', name), os.path.join(path, 'patch_mask', name),
+              os.path.join(path, 'patch_full_img', name), patch_size)
+    return (path_img, path_mask, path_full_img, ids, os.path.join(path, 'patch_img', ''),
+            os.path.join(path, 'patch_full_img', ''), os.path.join(path, 'patch_mask', ''))
+
+
+def prepare_reader(reader, ids, *path_templates):
+    # stores read by the 'mmap' and 'tiled' readers, written once
+    if reader == 'mmap':
+        from tile_store import convert_tiles
+        convert_tiles(ids, *path_templates)
+    elif reader == 'tiled':
+        from tiled_tiff import write_tiled
+        for path_template in path_templates:
+            for id in ids:
+                write_tiled(path_template.format(id))
+
+
+def bench(gen, steps, warmup=5):
+    """
+    Draws warmup batches and then times steps batches of gen.
+    :return: dict of the measures, the times split by the STATS of generator.py
+    """
+    for _ in range(warmup):
+        next(gen)
+    reset_stats()
+    bytes_start = read_bytes()
+    n_patches = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        batch_x, _ = next(gen)
+        n_patches += len(batch_x)
+    elapsed = time.perf_counter() - start
+    bytes_end = read_bytes()
+    rss, rss_children = peak_rss()
+    result = {'steps': steps, 'patches': n_patches, 'seconds': elapsed, 'patches_per_s': n_patches / elapsed,
+              'steps_per_s': steps / elapsed, 'decode_s': STATS['decode'], 'crop_s': STATS['crop'],
+              'assemble_s': STATS['assemble'], 'background_s': STATS['background'], 'tif_bytes': STATS['bytes'],
+              'peak_rss': rss, 'peak_rss_children': rss_children}
+    # time of the loop not spent in the generators of the main thread: sampling, waiting for workers and threads, the
+    # time of the other threads overlaps the loop and is not part of the split
+    result['other_s'] = elapsed - STATS['decode'] - STATS['crop'] - STATS['assemble']
+    if bytes_start is not None:
+        result['read_bytes'] = bytes_end - bytes_start
+    return result
+
+
+def report(name, result):
+    def mb(n):
+        return 'n/a' if n is None else '{:.1f} MB'.format(n / 2 ** 20)
+    print('{}: {} steps, {} patches in {:.2f} s'.format(name, result['steps'], result['patches'], result['seconds']))
+    print('  {:.1f} patches/s, {:.2f} steps/s'.format(result['patches_per_s'], result['steps_per_s']))
+    for key in ('decode_s', 'crop_s', 'assemble_s', 'other_s'):
+        print('  {:<12} {:8.3f} s  {:5.1f} %'.format(key, result[key], 100 * result[key] / result['seconds']))
+    print('  {:<12} {:8.3f} s  in other threads, overlapping the above'.format('background_s', result['background_s']))
+    print('  tifs decoded {}, read by the process {}'.format(mb(result['tif_bytes']), mb(result.get('read_bytes'))))
+    print('  peak rss {}, workers {}'.format(mb(result['peak_rss']), mb(result['peak_rss_children'])))
+
+
+def make_generator(args, paths):
+    path_img, path_mask, path_full_img, ids, path_patch_img, path_patch_full_img, path_patch_mask = paths
+    if args.generator == 'val':
+        if args.workers > 1:
+            from batch_producer import parallel_val_generator
+            return parallel_val_generator(path_patch_img, path_patch_full_img, path_patch_mask, args.batch_size,
+                                          args.workers)
+        return generator.val_generator(path_patch_img, path_patch_full_img, path_patch_mask, args.batch_size)
+    if args.generator == 'inria':
+        # the three datasets of generator_inria read the same tiles
+        from generator_inria import image_generator
+        return image_generator(path_img, path_full_img, path_mask, ids, path_img, path_full_img, path_mask, ids,
+                               path_img, path_full_img, path_mask, ids, args.batch_size, args.patch_size,
+                               args.cache_bytes, args.cache_reuse)
+    prepare_reader(args.reader, ids, path_img, path_mask, path_full_img)
+    files_weights = np.ones(len(ids)) / len(ids)
+    if args.generator == 'tf.data':
+        from data_pipeline import build_dataset, dataset_generator
+        dataset = build_dataset(ids, path_img, path_mask, path_full_img, files_weights, args.batch_size,
+                                args.patch_size, args.reader, cache_bytes=args.cache_bytes,
+                                cache_reuse=args.cache_reuse)
+        return dataset_generator(dataset)
+    if args.workers > 1:
+        from batch_producer import parallel_image_generator
+        return parallel_image_generator(ids, path_img, path_mask, path_full_img, files_weights, args.batch_size,
+                                        args.patch_size, args.reader, args.workers, cache_bytes=args.cache_bytes,
+                                        cache_reuse=args.cache_reuse)
+    return generator.image_generator(ids, path_img, path_mask, path_full_img, files_weights, args.batch_size,
+                                     args.patch_size, args.reader, cache_bytes=args.cache_bytes,
+                                     cache_reuse=args.cache_reuse)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures how fast the input pipelines produce training batches.')
+    parser.add_argument('--generator', default='image', choices=['image', 'inria', 'val', 'tf.data'])
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--patch-size', type=int, default=160)
+    parser.add_argument('--reader', default='tiff', choices=['tiff', 'mmap', 'tiled'])
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes of batch_producer.py, the time split only covers the main process')
+    parser.add_argument('--cache-bytes', type=int, default=None)
+    parser.add_argument('--cache-reuse', type=int, default=None)
+    parser.add_argument('--path-img', help='template of the image tiles, e.g. .../area{}.tif')
+    parser.add_argument('--path-mask')
+    parser.add_argument('--path-full-img')
+    parser.add_argument('--ids', nargs='+', help='ids of the tiles')
+    parser.add_argument('--path-patch-img', help='directory of the validation patches')
+    parser.add_argument('--path-patch-mask')
+    parser.add_argument('--path-patch-full-img')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='N_TILES',
+                        help='benchmark on N_TILES random tiles written to a temporary directory instead of the paths')
+    parser.add_argument('--tile-size', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    tmp_dir = None
+    if args.synthetic:
+        tmp_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+        paths = make_synthetic(tmp_dir, args.synthetic, args.tile_size, args.patch_size,
+                               n_patches=args.batch_size * (args.steps + args.warmup))
+    else:
+        paths = (args.path_img, args.path_mask, args.path_full_img, args.ids, args.path_patch_img,
+                 args.path_patch_full_img, args.path_patch_mask)
+    try:
+        result = bench(make_generator(args, paths), args.steps, args.warmup)
+        report('{} ({}, {} workers)'.format(args.generator, args.reader, args.workers), result)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return result
+
+
+if __name__ == '__main__':
+    main()
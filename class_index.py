@@ -0,0 +1,214 @@
+import os
+import sys
+import numpy as np
+import tifffile as tiff
+
+# side in pixels of the cells the class counts are summed over, patch sizes should divide by it
+STRIDE = 16
+VALID_SUFFIX = '.valid.npz'
+
+
+def cell_sat(planes, stride=STRIDE):
+    """
+    Summed-area table of the per-cell sums of planes.
+    :param planes: ndarray with shape (x_sz, y_sz, num_planes)
+    :return: ndarray with shape (x_sz // stride + 1, y_sz // stride + 1, num_planes), sat[i, j] is the sum of the
+    cells above and left of cell (i, j)
+    """
+    x_cells, y_cells = planes.shape[0] // stride, planes.shape[1] // stride
+    sat = np.zeros((x_cells + 1, y_cells + 1, planes.shape[2]), dtype='float64')
+    # row blocks of cells, so a memory-mapped mask is never loaded whole
+    for i in range(x_cells):
+        rows = np.asarray(planes[i * stride:(i + 1) * stride, :y_cells * stride], dtype='float64')
+        sat[i + 1, 1:] = rows.reshape(stride, y_cells, stride, -1).sum(axis=(0, 2))
+    return sat.cumsum(axis=0).cumsum(axis=1)
+
+
+def window_sums(sat, n_cells):
+    # sums over every window of n_cells x n_cells cells, in O(1) per window
+    return sat[n_cells:, n_cells:] - sat[:-n_cells, n_cells:] - sat[n_cells:, :-n_cells] + sat[:-n_cells, :-n_cells]
+
+
+def load_or_build(mask_path, stride=STRIDE, suffix='.classidx.npz', planes_fn=None, key=''):
+    """
+    Loads the index of the mask, stored next to it, rebuilding it when the mask changed since it was written.
+    :param planes_fn: function turning the decoded file into the planes summed by the index, the mask itself by default
+    :param key: string of the parameters of planes_fn, e.g. the mask format or the nodata value, stored with the index
+    so an index built with other parameters is rebuilt
+    :return: dict with the summed-area table 'sat', the 'stride' and the 'shape' of the mask
+    """
+    path = os.path.splitext(mask_path)[0] + suffix
+    stat = os.stat(mask_path)
+    if os.path.isfile(path):
+        index = np.load(path)
+        if (index['mtime'] == stat.st_mtime and index['size'] == stat.st_size and index['stride'] == stride and
+                'key' in index.files and str(index['key']) == key):
+            return {'sat': index['sat'], 'stride': int(index['stride']), 'shape': tuple(index['shape'])}
+    planes = tiff.imread(mask_path)
+    if planes_fn is not None:
+        planes = planes_fn(planes)
+    sat = cell_sat(planes, stride)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, sat=sat, stride=stride, shape=planes.shape[:2], mtime=stat.st_mtime, size=stat.st_size, key=key)
+    os.replace(tmp_path, path)
+    return {'sat': sat, 'stride': stride, 'shape': planes.shape[:2]}
+
+
+def valid_planes(img, nodata=0):
+    # 1 where any band differs from nodata: the all-zero one-hot of the filler of the rotated masks, the zero padding
+    return np.any(img.reshape(img.shape[0], img.shape[1], -1) != nodata, axis=2)[:, :, None].astype('uint8')
+
+
+def load_valid(path, stride=STRIDE, nodata=0):
+    """
+    Valid-pixel index of a mask or an image, see valid_planes, stored next to it.
+    """
+    return load_or_build(path, stride, VALID_SUFFIX, lambda img: valid_planes(img, nodata), 'nodata {}'.format(nodata))
+
+
+def is_nodata(index, x0, y0, height, width):
+    """
+    True when the cells covering the window hold no valid pixel, in O(1). Windows reaching the pixels past the last
+    whole cell, which the index does not cover, are never nodata.
+    """
+    sat = index['sat']
+    stride = index['stride']
+    x1, y1 = -(-(x0 + height) // stride), -(-(y0 + width) // stride)
+    if x1 >= sat.shape[0] or y1 >= sat.shape[1]:
+        return False
+    x0, y0 = x0 // stride, y0 // stride
+    return sat[x1, y1, 0] - sat[x0, y1, 0] - sat[x1, y0, 0] + sat[x0, y0, 0] == 0
+
+
+class AliasTable(object):
+    """
+    Walker's alias method, draws an index with probability proportional to weights in O(1).
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype='float64').ravel()
+        n = len(weights)
+        prob = weights * n / weights.sum()
+        self.prob = np.ones(n, dtype='float32')
+        self.alias = np.arange(n, dtype='int32')
+        small = list(np.flatnonzero(prob < 1))
+        large = list(np.flatnonzero(prob >= 1))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = prob[s]
+            self.alias[s] = l
+            prob[l] -= 1 - prob[s]
+            if prob[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+
+    def draw(self, rng):
+        i = rng.integers(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class ClassSampler(object):
+    """
+    Draws crops with target class proportions: a class is drawn from class_weights, then a crop with probability
+    proportional to the number of pixels of that class it holds. Tiles without the class get a uniform crop, or one
+    from valid.
+    :param indexes: indexes from load_or_build, one per tile
+    :param class_weights: target proportion of each class
+    :param valid: ValidSampler, the crops below its valid fraction are not drawn (up to the shift inside the cell)
+    """
+
+    def __init__(self, indexes, class_weights, patch_size, valid=None):
+        self.indexes = indexes
+        self.valid = valid
+        self.class_weights = np.asarray(class_weights, dtype='float64') / np.sum(class_weights)
+        self.patch_size = patch_size
+        self.tables = dict()
+
+    def table(self, tile, cl):
+        # alias tables are built the first time the tile and class are drawn
+        if (tile, cl) not in self.tables:
+            index = self.indexes[tile]
+            counts = window_sums(index['sat'][:, :, cl], self.patch_size // index['stride'])
+            if self.valid is not None:
+                counts = counts * self.valid.accepted(tile)
+            self.tables[tile, cl] = (AliasTable(counts) if counts.sum() > 0 else None, counts.shape)
+        return self.tables[tile, cl]
+
+    def sample(self, rng, files):
+        """
+        :return: (ux, uy) the crop offsets as fractions of the range of each tile, see gen_patches.crop_offsets
+        """
+        n = len(files)
+        classes = rng.choice(len(self.class_weights), n, p=self.class_weights)
+        ux, uy = np.empty(n), np.empty(n)
+        for i in range(n):
+            index = self.indexes[files[i]]
+            stride = index['stride']
+            x_range = index['shape'][0] - self.patch_size + 1
+            y_range = index['shape'][1] - self.patch_size + 1
+            table, grid = self.table(files[i], classes[i])
+            if table is None and self.valid is not None:
+                (ux[i],), (uy[i],) = self.valid.sample(rng, files[i:i + 1])
+                continue
+            if table is None:
+                ux[i], uy[i] = rng.random(), rng.random()
+                continue
+            cx, cy = np.unravel_index(table.draw(rng), grid)
+            # random shift inside the cell so the crops are not aligned on the grid
+            x = min(cx * stride + rng.integers(stride), x_range - 1)
+            y = min(cy * stride + rng.integers(stride), y_range - 1)
+            ux[i], uy[i] = (x + 0.5) / x_range, (y + 0.5) / y_range
+        return ux, uy
+
+
+class ValidSampler(object):
+    """
+    Draws crops uniformly among the crops whose fraction of valid pixels is at least min_valid, from the indexes of
+    load_valid. The crops are aligned on the cells so their fraction is exact. Tiles without such crops get a uniform
+    crop.
+    """
+
+    def __init__(self, indexes, patch_size, min_valid=0.5):
+        self.indexes = indexes
+        self.patch_size = patch_size
+        self.min_valid = min_valid
+        self.windows = dict()
+
+    def accepted(self, tile):
+        # boolean grid of the windows of the tile over min_valid, built the first time the tile is drawn
+        if tile not in self.windows:
+            index = self.indexes[tile]
+            n_cells = self.patch_size // index['stride']
+            counts = window_sums(index['sat'][:, :, 0], n_cells)
+            accepted = counts >= self.min_valid * (n_cells * index['stride']) ** 2
+            self.windows[tile] = (accepted, np.flatnonzero(accepted))
+        return self.windows[tile][0]
+
+    def sample(self, rng, files):
+        """
+        :return: (ux, uy) the crop offsets as fractions of the range of each tile, see gen_patches.crop_offsets
+        """
+        n = len(files)
+        ux, uy = np.empty(n), np.empty(n)
+        for i in range(n):
+            index = self.indexes[files[i]]
+            accepted = self.accepted(files[i])
+            flat = self.windows[files[i]][1]
+            x_range = index['shape'][0] - self.patch_size + 1
+            y_range = index['shape'][1] - self.patch_size + 1
+            if len(flat) == 0:
+                ux[i], uy[i] = rng.random(), rng.random()
+                continue
+            cx, cy = np.unravel_index(flat[rng.integers(len(flat))], accepted.shape)
+            x = min(cx * index['stride'], x_range - 1)
+            y = min(cy * index['stride'], y_range - 1)
+            ux[i], uy[i] = (x + 0.5) / x_range, (y + 0.5) / y_range
+        return ux, uy
+
+
+if __name__ == '__main__':
+    # python class_index.py <mask tif> [<mask tif> ...]
+    for path in sys.argv[1:]:
+        print(path, load_or_build(path)['sat'][-1, -1])
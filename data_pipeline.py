@@ -0,0 +1,98 @@
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+from augment import d4_batch
+from gen_patches import crop_offsets, alloc_batch, extract_batch
+from generator import get_input, get_mask, crop_sampler
+from mask_format import expand
+from gen_mask_neighbor import soft_boundary
+import manifest
+from sampler import StepSampler
+from tile_cache import TileCache
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+def build_dataset(ids_file, path_image, path_mask, path_full_img, files_weights, batch_size = 5, patch_size = 160,
+                  reader = 'tiff', seed = 0, initial_step = 0, cache_bytes = None, cache_reuse = None, augment = True,
+                  num_parallel_calls = AUTOTUNE, mask_format = 'onehot', n_classes = None, class_weights = None,
+                  min_valid = None, path_valid = None, boundary_radius = None):
+    """
+    tf.data version of generator.image_generator, yielding the same batches (batch_x, (batch_y, batch_y2)) for the
+    outputs output1 (mask) and output2 (full image) of wnet_model.
+    The steps are read and cropped by parallel calls of a py_func, the D4 transformations are applied by the graph and
+    the batches are prefetched while the model trains.
+    :param cache_bytes: budget of a TileCache shared by the parallel calls, see generator.image_generator
+    :param files_weights: see generator.image_generator, None for weights proportional to the areas of the tiles
+    :param mask_format: see generator.image_generator, the masks are expanded by the py_func
+    :param class_weights: see generator.image_generator, as min_valid and path_valid
+    :param boundary_radius: see generator.image_generator, the soft labels are computed by the py_func before the D4
+    transformations, which leave the square neighbourhoods of the boundaries unchanged
+    """
+    if files_weights is None:
+        files_weights = manifest.files_weights(path_image, ids_file)
+    def load_tile(id):
+        image = get_input(path_image.format(id), reader)
+        mask = get_mask(path_mask.format(id), reader)
+        full_img = get_input(path_full_img.format(id), reader)
+        return image, mask, full_img
+
+    cache = None
+    if cache_bytes is not None:
+        cache = TileCache(load_tile, cache_bytes, cache_reuse)
+    class_sampler = crop_sampler(ids_file, path_mask, patch_size, class_weights, min_valid, path_valid, mask_format,
+                                 n_classes)
+    sampler = StepSampler(files_weights, batch_size, seed, per_patch = cache is not None, augment = augment,
+                          class_sampler = class_sampler)
+
+    def load_step(step):
+        files_choice, ux, uy, ks = sampler.sample(int(step))
+        if cache is None:
+            tiles = [load_tile(ids_file[files_choice[0]])] * batch_size
+        else:
+            tiles = [cache.get(ids_file[f]) for f in files_choice]
+        xs, ys = crop_offsets(tiles, ux, uy, patch_size)
+        # raw crops, the transformations are left to the graph
+        batch = extract_batch(tiles, alloc_batch(tiles[0], batch_size, patch_size), xs, ys,
+                              np.zeros(batch_size, dtype=int), patch_size)
+        batch[1] = expand(batch[1], n_classes, mask_format)
+        if boundary_radius:
+            batch[1] = soft_boundary(batch[1], boundary_radius)
+        return batch + [ks.astype('int32')]
+
+    # dtypes and shapes of the batches
+    probe = load_step(initial_step)
+    dtypes = [tf.as_dtype(a.dtype) for a in probe]
+
+    def load(step):
+        arrays = tf.py_func(load_step, [step], dtypes)
+        for a, p in zip(arrays, probe):
+            a.set_shape(p.shape)
+        return tuple(arrays)
+
+    def transform(batch_x, batch_y, batch_y2, ks):
+        if augment:
+            batch_x, batch_y, batch_y2 = d4_batch(batch_x, ks), d4_batch(batch_y, ks), d4_batch(batch_y2, ks)
+        return batch_x, (batch_y, batch_y2)
+
+    dataset = tf.data.Dataset.range(initial_step, np.iinfo('int64').max)
+    dataset = dataset.map(load, num_parallel_calls = num_parallel_calls)
+    dataset = dataset.map(transform, num_parallel_calls = num_parallel_calls)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def dataset_generator(dataset, sess = None):
+    """
+    Python generator over a dataset from build_dataset, for model.fit_generator of keras.
+    :param sess: session running the pipeline in graph mode, keras' session by default
+    """
+    if tf.executing_eagerly():
+        for batch_x, (batch_y, batch_y2) in dataset:
+            yield (batch_x.numpy(), [batch_y.numpy(), batch_y2.numpy()])
+    else:
+        if sess is None:
+            sess = K.get_session()
+        next_batch = tf.compat.v1.data.make_one_shot_iterator(dataset).get_next()
+        while True:
+            batch_x, (batch_y, batch_y2) = sess.run(next_batch)
+            yield (batch_x, [batch_y, batch_y2])
@@ -0,0 +1,63 @@
+import os
+import sys
+import csv
+import pickle
+
+GRID_SIZES = 'grid_sizes.csv'
+TRAIN_WKT = 'train_wkt_v4.csv'
+INDEX_NAME = 'wkt_index.pkl'
+
+csv.field_size_limit(sys.maxsize)
+
+
+def _stats(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def parse_grid_sizes(path):
+    # ImageId, Xmax, Ymin
+    with open(path) as f:
+        rows = csv.reader(f)
+        next(rows)
+        return dict((im_id, (float(x), float(y))) for im_id, x, y in rows)
+
+
+def parse_wkt(path):
+    # ImageId, ClassType, MultipolygonWKT, the WKT are parsed by the workers that rasterize them
+    index = {}
+    with open(path) as f:
+        rows = csv.reader(f)
+        next(rows)
+        for im_id, poly_type, poly in rows:
+            index.setdefault(im_id, {})[poly_type] = poly
+    return index
+
+
+def load_index(path):
+    """
+    Grid sizes and polygons of the DSTL dataset, parsed from the csvs once and stored in path/wkt_index.pkl, read
+    back while the csvs are unchanged.
+    :param path: directory of grid_sizes.csv and train_wkt_v4.csv
+    :return: (grid, wkt), grid[im_id] = (x_max, y_min) and wkt[im_id][poly_type] = WKT of the polygons
+    """
+    sources = [os.path.join(path, GRID_SIZES), os.path.join(path, TRAIN_WKT)]
+    stats = [_stats(p) for p in sources]
+    index_path = os.path.join(path, INDEX_NAME)
+    if os.path.isfile(index_path):
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+        if index['stats'] == stats:
+            return index['grid'], index['wkt']
+    grid, wkt = parse_grid_sizes(sources[0]), parse_wkt(sources[1])
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'stats': stats, 'grid': grid, 'wkt': wkt}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+    return grid, wkt
+
+
+if __name__ == '__main__':
+    # python dstl_index.py <dataset directory>
+    grid, wkt = load_index(sys.argv[1])
+    print('{} grid sizes, {} images with polygons'.format(len(grid), len(wkt)))
@@ -1,6 +1,10 @@
 import os.path
 import tifffile as tiff
 import numpy as np
+from quantize import quantize
+
+# 'uint8' keeps the images as they are, img/255 being only a scale the model applies itself with uint8_inputs=True
+OUTPUT_DTYPE = 'float64'
 
 val_ids = ['5', '7', '23', '37']
 name_template = '/top_mosaic_09cm_area{}.tif'
@@ -17,4 +21,4 @@ files = [f for f in os.listdir(path_img) if os.path.isfile(os.path.join(path_img
 for f in files:
     img = tiff.imread(path_img + f)
     new_img = img/255
-    tiff.imsave(new_path_img+f, new_img)
\ No newline at end of file
+    tiff.imsave(new_path_img+f, quantize(new_img, OUTPUT_DTYPE))
\ No newline at end of file
@@ -46,9 +46,16 @@ paths = {#'ids_inria_train': [ids_inria_train, path_img_inria, new_path_img_inri
         'ids_vaihingen_val': [ids_vaihingen_val, path_img_vaihingen, new_path_img_vaihingen],
         'ids_vaihingen_test': [ids_vaihingen_test, path_img_vaihingen, new_path_img_vaihingen]}
 
-for p in paths:
-    print(p)
-    for id in paths[p][0]:
-        img = tiff.imread(paths[p][1].format(id))[:,:,0]
-        img = np.expand_dims(img, axis = 2)
-        tiff.imsave(paths[p][2].format(id), img)
+
+def l_image(img):
+    # first channel of the image, L of the Lab images
+    img = img[:,:,0]
+    return np.expand_dims(img, axis = 2)
+
+
+if __name__ == '__main__':
+    for p in paths:
+        print(p)
+        for id in paths[p][0]:
+            img = l_image(tiff.imread(paths[p][1].format(id)))
+            tiff.imsave(paths[p][2].format(id), img)
@@ -1,42 +1,76 @@
 import tifffile as tiff
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from scipy.ndimage import minimum_filter
+from mask_format import to_soft
 
-def gen_mask():
+# pixels closer than NEIGHBOR_RADIUS pixels (chessboard distance) to another class keep NEIGHBOR_WEIGHT on their
+# class and share the rest between the other classes
+NEIGHBOR_RADIUS = 3
+NEIGHBOR_WEIGHT = 0.75
+
+
+def boundary_pixels(mask, f=NEIGHBOR_RADIUS):
+    """
+    :param mask: one-hot ndarray with shape (..., x_sz, y_sz, n_classes), a tile or a batch of patches
+    :return: bool ndarray with shape (..., x_sz, y_sz), True for the pixels of a single class with a pixel of the
+    (2f + 1) x (2f + 1) square around them, inside the mask, that is not of that class
+    """
+    hard = mask == 1
+    single = hard.sum(axis=-1) == 1
+    size = (1,) * (mask.ndim - 3) + (2 * f + 1, 2 * f + 1)
+    boundary = np.zeros(mask.shape[:-1], dtype=bool)
+    for c in range(mask.shape[-1]):
+        # erosion of the pixels of the class, the pixels past the border of the mask do not count
+        inside = minimum_filter((mask[..., c] != 0).astype('uint8'), size=size, mode='constant', cval=1)
+        boundary |= hard[..., c] & (inside == 0)
+    return boundary & single
+
+
+def soft_boundary(mask, f=NEIGHBOR_RADIUS, weight=NEIGHBOR_WEIGHT, dtype='float32'):
+    """
+    Soft labels of the boundaries of the classes: the pixels of boundary_pixels get weight on their class and
+    (1 - weight) / (n_classes - 1) on each other class, the other pixels keep their labels.
+    Applied to the patches of a batch, the pixels of the other classes past the border of a patch are not seen.
+    """
+    n_classes = mask.shape[-1]
+    boundary = boundary_pixels(mask, f)
+    soft = mask.astype(dtype)
+    soft[boundary] = np.where(mask[boundary] == 1, weight, (1 - weight) / (n_classes - 1))
+    return soft
+
+
+def neighbor_mask(path, new_path, f=NEIGHBOR_RADIUS, weight=NEIGHBOR_WEIGHT, dtype='float64', mask_format='onehot'):
+    """
+    :param mask_format: 'soft' writes uint8 fixed point fractions (see mask_format.py)
+    """
+    mask = soft_boundary(tiff.imread(path), f, weight, dtype)
+    if mask_format == 'soft':
+        mask = to_soft(mask)
+    tmp_path = '{}.{}.tmp'.format(new_path, os.getpid())
+    tiff.imsave(tmp_path, mask)
+    os.replace(tmp_path, new_path)
+    return new_path
+
+
+def gen_mask(n_workers=4, f=NEIGHBOR_RADIUS, weight=NEIGHBOR_WEIGHT, mask_format='onehot'):
     train_ids = ['1', '3', '11', '13', '15', '17', '21', '26', '28', '30', '32', '34', '5', '7', '23', '37']
 
     path_mask = '/home/mdias/datasets/vaihingen/Masks'
     new_path_mask = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Masks_neighbor'
     name_template = '/top_mosaic_09cm_area{}.tif'
 
-    neighbors = []
-    f = 3
-    for i in range(-f, f + 1):
-        for j in range(-f, f + 1):
-            neighbors.append((i, j))
-    neighbors.remove((0, 0))
-    print(len(neighbors))
-
     if not os.path.exists(new_path_mask):
         os.makedirs(new_path_mask)
 
-    for mask_id in train_ids:
-        print(mask_id)
-        mask = tiff.imread(path_mask+name_template.format(mask_id)).astype(float)
-        x, y, dim = mask.shape
-        for i in range(x):
-            for j in range(y):
-                if len(np.argwhere(mask[i, j] == 1)) == 1:
-                    label = np.argwhere(mask[i, j] == 1)[0][0]
-                else:
-                    break
-                for n in neighbors:
-                    n_x = i + n[0]
-                    n_y = j + n[1]
-                    if 0 <= n_x < x and 0 <= n_y < y:
-                        if mask[n_x, n_y, label] == 0:
-                            mask[i, j, label] = 0.75
-                            mask[i, j, :label] = 0.25 / 5
-                            mask[i, j, label+1:] = 0.25 / 5
-        tiff.imsave(new_path_mask+name_template.format(mask_id), mask)
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [pool.submit(neighbor_mask, path_mask + name_template.format(mask_id),
+                               new_path_mask + name_template.format(mask_id), f, weight, 'float64', mask_format)
+                   for mask_id in train_ids]
+        for future in futures:
+            print(future.result())
+
 
+if __name__ == '__main__':
+    gen_mask()
@@ -49,6 +49,65 @@ def get_rand_patch(img, mask, full_img, sz=160):
     return patch_img, patch_mask, patch_full_img
 
 
+def d4_view(patch, k):
+    """
+    View of a square patch under one of the 8 transformations of the dihedral group D4.
+    :param k: int in [0, 8), bit 0 reverses the first dimension, bit 1 the second one and bit 2 transposes them
+    """
+    if k & 1:
+        patch = patch[::-1]
+    if k & 2:
+        patch = patch[:, ::-1]
+    if k & 4:
+        patch = patch.swapaxes(0, 1)
+    return patch
+
+
+def alloc_batch(tile, batch_size, sz=160):
+    """
+    :param tile: tuple of arrays (img, mask, full_img) with shape (x_sz, y_sz, ...)
+    :return: list of empty arrays with shape (batch_size, sz, sz, ...), one per array of the tile
+    """
+    return [np.empty((batch_size, sz, sz) + a.shape[2:], dtype=a.dtype) for a in tile]
+
+
+def extract_batch(tiles, batch, xs, ys, ks, sz=160):
+    """
+    Crops the patch i of every array of tiles[i] at (xs[i], ys[i]), transforms it with d4_view(ks[i]) and writes it
+    straight into batch, no patch is copied other than into its place in the batch.
+    :param tiles: list of tuples of arrays (img, mask, full_img), one tuple per patch of the batch
+    :param batch: list of arrays from alloc_batch
+    """
+    for i, tile in enumerate(tiles):
+        xc, yc, k = xs[i], ys[i], ks[i]
+        for a, out in zip(tile, batch):
+            out[i] = d4_view(a[xc:(xc + sz), yc:(yc + sz)], k)
+    return batch
+
+
+def crop_offsets(tiles, ux, uy, sz=160):
+    """
+    :param ux: fractions in [0, 1) of the range of the crop offset along the first dimension, one per tile
+    :return: (xs, ys) crop offsets of the patches
+    """
+    x_range = np.array([t[0].shape[0] - sz + 1 for t in tiles])
+    y_range = np.array([t[0].shape[1] - sz + 1 for t in tiles])
+    return (np.asarray(ux) * x_range).astype(int), (np.asarray(uy) * y_range).astype(int)
+
+
+def get_rand_batch(tiles, sz=160, rng=np.random, augment=True):
+    """
+    Draws the crop offsets and D4 transformations of the whole batch at once and extracts the patches.
+    :param tiles: list of tuples of arrays (img, mask, full_img), one tuple per patch of the batch
+    :param rng: np.random or a np.random.RandomState
+    :return: list of arrays with shape (len(tiles), sz, sz, ...), one per array of the tiles
+    """
+    n = len(tiles)
+    xs, ys = crop_offsets(tiles, rng.random_sample(n), rng.random_sample(n), sz)
+    ks = rng.randint(0, 8, n) if augment else np.zeros(n, dtype=int)
+    return extract_batch(tiles, alloc_batch(tiles[0], n, sz), xs, ys, ks, sz)
+
+
 def get_patches(x_dict, y_dict, n_patches, sz=160):
     x = list()
     y = list()
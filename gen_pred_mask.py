@@ -3,6 +3,7 @@ import math
 import os
 import sys
 import numpy as np
+from palette import mask_from_picture, picture_from_mask
 import matplotlib.pyplot as plt
 import tifffile as tiff
 import cv2
@@ -46,43 +47,6 @@ def predict(x, model, patch_sz=160, n_classes=5, step = 142):
     image_prediction = reconstruct_patches(patches_image, (dim_x, dim_y, 3), step)
     return prediction, image_prediction
 
-def picture_from_mask(mask):
-    colors = {
-        0: [255, 255, 255],   #imp surface
-        1: [255, 255, 0],     #car
-        2: [0, 0, 255],       #building
-        3: [255, 0, 0],       #background
-        4: [0, 255, 255],     #low veg
-        5: [0, 255, 0]        #tree
-    }
-
-    mask_ind = np.argmax(mask, axis=0)
-    pict = np.empty(shape=(3, mask.shape[1], mask.shape[2]))
-    for cl in range(6):
-      for ch in range(3):
-        pict[ch,:,:] = np.where(mask_ind == cl, colors[cl][ch], pict[ch,:,:])
-    return pict
-
-def mask_from_picture(picture):
-  colors = {
-      (255, 255, 255): 0,   #imp surface
-      (255, 255, 0): 1,     #car
-      (0, 0, 255): 2,       #building
-      (255, 0, 0): 3,       #background
-      (0, 255, 255): 4,     #low veg
-      (0, 255, 0): 5        #tree
-  }
-  picture = picture.transpose([1,2,0])
-  print('\n\n',picture.shape,'\n\n')
-  mask = np.ndarray(shape=(256*256*256), dtype='int32')
-  mask[:] = -1
-  for rgb, idx in colors.items():
-    rgb = rgb[0] * 65536 + rgb[1] * 256 + rgb[2]
-    mask[rgb] = idx
-
-  picture = picture.dot(np.array([65536, 256, 1], dtype='int32'))
-  return mask[picture]
-
 weights_path = '/home/mdias/weights/weights_W_potsdam_41/weights.hdf5'
 model = wnet_model(6, 320, n_channels=3)
 print(weights_path)
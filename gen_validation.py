@@ -1,6 +1,7 @@
 import os.path
 import cv2
 from get_step import *
+from val_shards import write_shard, write_index
 from patchify import patchify, unpatchify
 import tifffile as tiff
 import numpy as np
@@ -13,22 +14,19 @@ path_l = '/home/mdias/datasets/potsdam/Images_l/top_potsdam_{}_RGB.tif'
 path_img = '/home/mdias/datasets/potsdam/Images_lab_hist/top_potsdam_{}_RGB.tif'
 path_mask = '/home/mdias/datasets/potsdam/Masks/top_potsdam_{}_label.tif'
 
-name_template = 'top_potsdam_{}_patch.tif'
-path_patch_l = '/home/mdias/datasets/potsdam/Images_l_patch/'
-path_patch_img = '/home/mdias/datasets/potsdam/Images_lab_hist_patch/'
-path_patch_mask = '/home/mdias/datasets/potsdam/Masks_patch/'
+# one shard per image and target instead of one tif per patch, see val_shards.py
+path_shards = '/home/mdias/datasets/potsdam/val_shards/'
 
-paths = {path_l: path_patch_l, path_img: path_patch_img, path_mask: path_patch_mask}
+paths = {path_l: 'img', path_img: 'full_img', path_mask: 'mask'}
 
-for p in paths:
-    if not os.path.exists(paths[p]): os.makedirs(paths[p])
-    for the_file in os.listdir(paths[p]):
-        file_path = os.path.join(paths[p], the_file)
-        try:
-            if os.path.isfile(file_path) and '.tif' in file_path and 'patch' in file_path:
-                os.unlink(file_path)
-        except Exception as e:
-            print(e)
+if not os.path.exists(path_shards): os.makedirs(path_shards)
+for the_file in os.listdir(path_shards):
+    file_path = os.path.join(path_shards, the_file)
+    try:
+        if os.path.isfile(file_path) and ('.npy' in file_path or 'index.json' in file_path):
+            os.unlink(file_path)
+    except Exception as e:
+        print(e)
 
 for id in val_ids:
     paths_origin = list(paths.keys())
@@ -46,7 +44,6 @@ for id in val_ids:
         print(patches.shape)
         width_window, height_window, z, width_x, height_y, dim = patches.shape
         patches = np.reshape(patches, (width_window * height_window, width_x, height_y, dim))
-        batch_size, x, y, dim = patches.shape
-        for i in range(batch_size):
-            new_patch = np.array(patches[i], copy=True)
-            tiff.imsave(paths[p] + name_template.format(id + '_' + str(i)), new_patch)
+        write_shard(path_shards, paths[p], id, patches)
+
+write_index(path_shards, val_ids)
@@ -1,54 +1,162 @@
 import numpy as np
 from gen_patches import *
+from tile_store import open_tile
+from tile_cache import TileCache
+from tiled_tiff import open_tiled
+from sampler import StepSampler
+from class_index import load_or_build, load_valid, ClassSampler, ValidSampler
 import tifffile as tiff
 import os
+import time
+import threading
+import manifest
+from mask_format import expand, mask_planes, planes_key, nodata_value
+from gen_mask_neighbor import soft_boundary
 from os import listdir
 from os.path import isfile, join
 
-def get_input(path):
+# seconds spent by the generators of the main thread of this process decoding tiles, cropping and transforming the
+# patches and assembling the batches, seconds of the same work in the other threads (prefetch, tf.data calls), that
+# overlaps the main thread, and bytes of the tifs decoded, read by bench_pipeline.py
+STATS = {'decode': 0., 'crop': 0., 'assemble': 0., 'background': 0., 'bytes': 0}
+
+
+def reset_stats():
+    for key in STATS:
+        STATS[key] = 0
+
+
+def add_time(key, start):
+    if threading.current_thread() is not threading.main_thread():
+        key = 'background'
+    STATS[key] += time.perf_counter() - start
+
+
+def read_tile(path, reader='tiff'):
+    start = time.perf_counter()
+    if reader == 'mmap':
+        tile = open_tile(path)
+    elif reader == 'tiled':
+        tile = open_tiled(path)
+    else:
+        # the readers above only map the file, their reads are counted in the crops
+        tile = tiff.imread(path)
+        STATS['bytes'] += os.path.getsize(path)
+    add_time('decode', start)
+    return tile
+
+def get_input(path, reader='tiff'):
     #image = rasterio.open(path).read().transpose([1,2,0])
-    image = tiff.imread(path)
+    image = read_tile(path, reader)
     return image
 
-def get_mask(path):
-    mask = tiff.imread(path)
+def get_mask(path, reader='tiff'):
+    mask = read_tile(path, reader)
     return mask
 
 
-def image_generator(ids_file, path_image, path_mask, path_full_img, files_weights, batch_size = 5, patch_size = 160):
-    seed = 0
-    while True:
-        np.random.seed(seed)
-        file_choice = np.random.choice((len(ids_file)), p=files_weights)
-        id = ids_file[file_choice]
-        image = get_input(path_image.format(id))
-        mask = get_mask(path_mask.format(id))
-        full_img = get_input(path_full_img.format(id))
-        total_patches = 0
-        x = list()
-        y = list()
-        y2 = list()
-        while total_patches < batch_size:
-            img_patch, mask_patch, full_img_patch = get_rand_patch(image, mask, full_img, patch_size)
-            x.append(img_patch)
-            y.append(mask_patch)
-            y2.append(full_img_patch)
-            total_patches += 1
+def crop_sampler(ids_file, path_mask, patch_size, class_weights = None, min_valid = None, path_valid = None,
+                 mask_format = 'onehot', n_classes = None):
+    """
+    :return: the class_sampler of StepSampler for the class_weights and min_valid of image_generator, None for uniform
+    crops
+    """
+    valid = None
+    if min_valid is not None:
+        path_valid = path_valid or path_mask
+        nodata = nodata_value(mask_format) if path_valid == path_mask else 0
+        valid = ValidSampler([load_valid(path_valid.format(id), nodata=nodata) for id in ids_file], patch_size,
+                             min_valid)
+    if class_weights is None:
+        return valid
+    planes_fn = mask_planes(mask_format, n_classes)
+    key = planes_key(mask_format, n_classes)
+    return ClassSampler([load_or_build(path_mask.format(id), planes_fn=planes_fn, key=key) for id in ids_file],
+                        class_weights, patch_size, valid)
+
 
-        batch_x = np.array( x )
-        batch_y = np.array( y )
-        batch_y2 = np.array( y2 )
-        seed+=1
+def image_generator(ids_file, path_image, path_mask, path_full_img, files_weights, batch_size = 5, patch_size = 160,
+                    reader = 'tiff', seed = 0, initial_step = 0, step_stride = 1, cache_bytes = None,
+                    cache_reuse = None, cache_report = 1000, class_weights = None, augment = True,
+                    hard_miner = None, min_valid = None, path_valid = None, mask_format = 'onehot', n_classes = None,
+                    boundary_radius = None):
+    """
+    :param reader: 'tiff' decodes the whole tiles every step, 'mmap' crops the patches from the stores written by
+    tile_store.py so only the pages of the patches are read, 'tiled' decodes only the tiles of the patches from the
+    tiled tifs written by tiled_tiff.py
+    :param seed: key of the StepSampler, the step alone decides the tiles, crops and transformations of its batch
+    :param initial_step: first step drawn, to resume a training at the step it stopped
+    :param step_stride: increment between the steps drawn, workers of batch_producer.py start at initial_step + worker
+    index with step_stride = number of workers so they never draw the same step
+    :param cache_bytes: budget of a TileCache of decoded tiles, with a cache every patch of the batch draws its own
+    tile instead of the whole batch coming from one tile
+    :param cache_reuse: number of patches a cached tile serves before it is evicted
+    :param cache_report: number of steps between prints of the cache hit rate
+    :param class_weights: target proportion of each class in the patches, the crops are drawn from the summed-area
+    tables of class_index.py, built next to the masks the first time
+    :param augment: apply the D4 transformations, False yields the raw crops for a wnet_model built with augment=True
+    :param min_valid: minimum fraction of valid pixels of the crops, e.g. to skip the filler of the tiles of
+    rotate_crop.py, from the valid-pixel indexes of class_index.load_valid built next to the files the first time
+    :param path_valid: template of the files the valid pixels are read from, the masks by default (the filler has no
+    class)
+    :param hard_miner: hard_mining.HardExampleMiner drawing the tiles and crops by the losses of their regions, the
+    batches are recorded in it for a HardExampleCallback
+    :param files_weights: probability of drawing each tile, None for weights proportional to the areas of the tiles
+    read from the manifest of path_image (manifest.py)
+    :param mask_format: format of the masks, 'index' or 'soft' masks (mask_format.py) are cropped as stored and
+    expanded to n_classes float32 planes per batch
+    :param boundary_radius: soft labels on the class boundaries of the patches, see gen_mask_neighbor.soft_boundary,
+    instead of the masks written by gen_mask_neighbor.gen_mask
+    """
+    if files_weights is None:
+        files_weights = manifest.files_weights(path_image, ids_file)
+    def load_tile(id):
+        image = get_input(path_image.format(id), reader)
+        mask = get_mask(path_mask.format(id), reader)
+        full_img = get_input(path_full_img.format(id), reader)
+        return image, mask, full_img
+
+    cache = None
+    if cache_bytes is not None:
+        cache = TileCache(load_tile, cache_bytes, cache_reuse)
+    class_sampler = crop_sampler(ids_file, path_mask, patch_size, class_weights, min_valid, path_valid, mask_format,
+                                 n_classes)
+    sampler = StepSampler(files_weights, batch_size, seed, per_patch = cache is not None,
+                          augment = augment, class_sampler = class_sampler, hard_miner = hard_miner)
+    step = initial_step
+    while True:
+        files_choice, ux, uy, ks = sampler.sample(step)
+        if cache is None:
+            tiles = [load_tile(ids_file[files_choice[0]])] * batch_size
+        else:
+            tiles = [cache.get(ids_file[f]) for f in files_choice]
+        start = time.perf_counter()
+        batch = alloc_batch(tiles[0], batch_size, patch_size)
+        add_time('assemble', start)
+        start = time.perf_counter()
+        xs, ys = crop_offsets(tiles, ux, uy, patch_size)
+        batch_x, batch_y, batch_y2 = extract_batch(tiles, batch, xs, ys, ks, patch_size)
+        add_time('crop', start)
+        batch_y = expand(batch_y, n_classes, mask_format)
+        if boundary_radius:
+            batch_y = soft_boundary(batch_y, boundary_radius)
+        if hard_miner is not None:
+            hard_miner.record(files_choice, xs, ys, (batch_x, batch_y, batch_y2))
+        step+=step_stride
+        if cache is not None and (step - initial_step) // step_stride % cache_report == 0:
+            print('\ntile cache', cache.stats())
         yield ( batch_x, [batch_y , batch_y2])
         #yield ( batch_x, batch_y )
 
 
-def val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = 5):
-    files = [f for f in listdir(path_patch_img) if isfile(join(path_patch_img, f))]
+def val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = 5, shard = 0, n_shards = 1,
+                  mask_format = 'onehot', n_classes = None):
+    # each worker of batch_producer.py reads its own shard of the patches
+    files = sorted(f for f in listdir(path_patch_img) if isfile(join(path_patch_img, f)))[shard::n_shards]
 
     while True:
         if len(files) < 10:
-            files = [f for f in listdir(path_patch_img) if isfile(join(path_patch_img, f))]
+            files = sorted(f for f in listdir(path_patch_img) if isfile(join(path_patch_img, f)))[shard::n_shards]
         total_patches = 0
         x = list()
         y = list()
@@ -60,7 +168,9 @@ def val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_si
             y2.append(get_input(path_patch_full_img+file))
             total_patches += 1
 
+        start = time.perf_counter()
         batch_x = np.array(x)
-        batch_y = np.array(y)
+        batch_y = expand(np.array(y), n_classes, mask_format)
         batch_y2 = np.array(y2)
+        add_time('assemble', start)
         yield (batch_x, [batch_y, batch_y2])
@@ -1,5 +1,6 @@
 import numpy as np
 from gen_patches import *
+from mask_format import expand
 import tifffile as tiff
 import os
 from os import listdir
@@ -15,7 +16,8 @@ def get_mask(path):
     return mask
 
 
-def image_generator(ids_file, path_image, path_mask, path_full_img, batch_size = 5, patch_size = 160):
+def image_generator(ids_file, path_image, path_mask, path_full_img, batch_size = 5, patch_size = 160,
+                    mask_format = 'onehot', n_classes = None):
     seed = 0
     while True:
         np.random.seed(seed)
@@ -24,20 +26,8 @@ def image_generator(ids_file, path_image, path_mask, path_full_img, batch_size =
         image = get_input(path_image.format(id))
         mask = get_mask(path_mask.format(id))
         full_img = get_input(path_full_img.format(id))
-        total_patches = 0
-        x = list()
-        y = list()
-        y2 = list()
-        while total_patches < batch_size:
-            img_patch, mask_patch, full_img_patch = get_rand_patch(image, mask, full_img, patch_size)
-            x.append(img_patch)
-            y.append(mask_patch)
-            y2.append(full_img_patch)
-            total_patches += 1
-
-        batch_x = np.array( x )
-        batch_y = np.array( y )
-        batch_y2 = np.array( y2 )
+        batch_x, batch_y, batch_y2 = get_rand_batch([(image, mask, full_img)] * batch_size, patch_size)
+        batch_y = expand(batch_y, n_classes, mask_format)
         seed+=1
         yield ( batch_x, [batch_y , batch_y2])
         #yield ( batch_x, batch_y )
@@ -1,5 +1,6 @@
 import numpy as np
 from gen_patches_inria import *
+from stream_mixer import DatasetSource, StreamMixer
 import tifffile as tiff
 import os
 from os import listdir
@@ -18,56 +19,32 @@ def get_mask(path):
 def image_generator(path_img_inria, path_full_img_inria, path_mask_inria, ids_inria,
                                     path_img_potsdam, path_full_img_potsdam, path_mask_potsdam, ids_potsdam,
                                     path_img_vaihingen, path_full_img_vaihingen, path_mask_vaihingen, ids_vaihingen,
-                                    batch_size = 5, patch_size = 160):
-    seed = 0
-    while True:
-        datasets_choice = ['inria', 'potsdam', 'vaihingen']
-        datasets_chance = [0.2, 0.4, 0.4]
-        np.random.seed(seed)
-        dataset = np.random.choice(datasets_choice, p=datasets_chance)
-
-        if dataset == 'inria':
-            path_image = path_img_inria
-            path_mask = path_mask_inria
-            path_full_img = path_full_img_inria
-            ids_file = ids_inria
-
-        if dataset == 'potsdam':
-            path_image = path_img_potsdam
-            path_mask = path_mask_potsdam
-            path_full_img = path_full_img_potsdam
-            ids_file = ids_potsdam
+                                    batch_size = 5, patch_size = 160, cache_bytes = None, cache_reuse = None,
+                                    prefetch = 2, mixer = None):
+    """
+    :param cache_bytes: budget of the TileCache of each dataset
+    :param mixer: StreamMixer to use instead of the default one, e.g. to change its weights with a MixerWeights callback
+    """
+    if mixer is None:
+        mixer = inria_mixer(path_img_inria, path_full_img_inria, path_mask_inria, ids_inria,
+                            path_img_potsdam, path_full_img_potsdam, path_mask_potsdam, ids_potsdam,
+                            path_img_vaihingen, path_full_img_vaihingen, path_mask_vaihingen, ids_vaihingen,
+                            batch_size, patch_size, cache_bytes, cache_reuse, prefetch)
+    return mixer.generator()
 
-        if dataset == 'vaihingen':
-            path_image = path_img_vaihingen
-            path_mask = path_mask_vaihingen
-            path_full_img = path_full_img_vaihingen
-            ids_file = ids_vaihingen
-
-        np.random.seed(seed)
-        file_choice = np.random.choice((len(ids_file)))
-        id = ids_file[file_choice]
-
-        image = get_input(path_image.format(id))
-        mask = get_mask(path_mask.format(id))
-        full_img = get_input(path_full_img.format(id))
-        total_patches = 0
-        x = list()
-        y = list()
-        y2 = list()
-        while total_patches < batch_size:
-            img_patch, mask_patch, full_img_patch = get_rand_patch(image, mask, full_img, patch_size)
-            x.append(img_patch)
-            y.append(mask_patch)
-            y2.append(full_img_patch)
-            total_patches += 1
 
-        batch_x = np.array( x )
-        batch_y = np.array( y )
-        batch_y2 = np.array( y2 )
-        seed+=1
-        yield ( batch_x, [batch_y , batch_y2])
-        #yield ( batch_x, batch_y )
+def inria_mixer(path_img_inria, path_full_img_inria, path_mask_inria, ids_inria,
+                path_img_potsdam, path_full_img_potsdam, path_mask_potsdam, ids_potsdam,
+                path_img_vaihingen, path_full_img_vaihingen, path_mask_vaihingen, ids_vaihingen,
+                batch_size = 5, patch_size = 160, cache_bytes = None, cache_reuse = None, prefetch = 2):
+    sources = [DatasetSource('inria', path_img_inria, path_mask_inria, path_full_img_inria, ids_inria, 0.2,
+                             cache_bytes, cache_reuse, prefetch, seed = 0),
+               DatasetSource('potsdam', path_img_potsdam, path_mask_potsdam, path_full_img_potsdam, ids_potsdam, 0.4,
+                             cache_bytes, cache_reuse, prefetch, seed = 1),
+               DatasetSource('vaihingen', path_img_vaihingen, path_mask_vaihingen, path_full_img_vaihingen,
+                             ids_vaihingen, 0.4, cache_bytes, cache_reuse, prefetch, seed = 2)]
+    # no flips/transposes, as in gen_patches_inria.get_rand_patch
+    return StreamMixer(sources, batch_size, patch_size, per_patch = cache_bytes is not None, augment = False)
 
 
 def val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = 5):
@@ -0,0 +1,156 @@
+import threading
+from collections import deque
+import numpy as np
+from keras.callbacks import Callback
+from quantize import dequantize
+
+
+def patch_losses(y, y2, pred, pred2, loss_weights=(0.95, 0.05), eps=1e-7):
+    """
+    Loss of every patch of a batch, the numpy counterpart of the losses of wnet_model: dice of the classes but the
+    last + binary crossentropy of the mask, and mean squared error of the full image.
+    :return: ndarray of shape (batch_size,)
+    """
+    axes = tuple(range(1, y.ndim))
+    y = y.astype('float32')
+    pred = np.clip(pred, eps, 1 - eps)
+    n_classes = y.shape[-1]
+    dice = 0.
+    for c in range(n_classes - 1):
+        intersection = (y[..., c] * pred[..., c]).sum(axis=axes[:-1])
+        dice += 1 - (2 * intersection + 1e-9) / (y[..., c].sum(axis=axes[:-1]) + pred[..., c].sum(axis=axes[:-1]) + 1e-9)
+    bce = -(y * np.log(pred) + (1 - y) * np.log(1 - pred)).mean(axis=axes)
+    # the uint8 full images of the quantized datasets are scaled as in the graph of the model
+    y2 = dequantize(y2)
+    mse = np.square(pred2 - y2).mean(axis=axes)
+    return loss_weights[0] * (dice / (n_classes - 1) + bce) + loss_weights[1] * mse
+
+
+class HardExampleMiner(object):
+    """
+    Priorities of the regions of the training tiles, from the losses of the patches cropped in them. Every tile is
+    split in cells of cell x cell crop origins, each keeping an exponential moving average of the losses of its
+    patches. The regions are drawn with probability
+        (1 - uniform) * softmax(loss / temperature) + uniform * area / total area
+    so a low temperature concentrates the patches on the hardest regions, and the uniform part keeps visiting all of
+    them. The regions never seen take the mean of the losses seen.
+    :param shapes: shapes of the tiles, e.g. from manifest.get_shape
+    :param decay: weight of the previous average when a region gets a new loss
+    :param history: number of recorded batches kept for HardExampleCallback
+    """
+
+    def __init__(self, shapes, patch_size, cell=None, temperature=0.1, uniform=0.3, decay=0.7, history=4):
+        self.patch_size = patch_size
+        self.cell = cell or patch_size
+        self.temperature = temperature
+        self.uniform = uniform
+        self.decay = decay
+        self.ranges = np.array([(s[0] - patch_size + 1, s[1] - patch_size + 1) for s in shapes])
+        # flat arrays over the cells of all tiles
+        tiles, cx, cy = [], [], []
+        self.first_cell = []
+        self.grid = []
+        for t, (x_range, y_range) in enumerate(self.ranges):
+            nx, ny = -(-x_range // self.cell), -(-y_range // self.cell)
+            self.first_cell.append(len(tiles))
+            self.grid.append((nx, ny))
+            gx, gy = np.meshgrid(np.arange(nx), np.arange(ny), indexing='ij')
+            tiles.extend([t] * (nx * ny))
+            cx.extend(gx.ravel())
+            cy.extend(gy.ravel())
+        self.tiles = np.array(tiles)
+        self.cx = np.array(cx)
+        self.cy = np.array(cy)
+        # number of crop origins of each cell, the last cells of a tile are smaller
+        self.widths = np.minimum(self.cell, self.ranges[self.tiles, 0] - self.cx * self.cell)
+        self.heights = np.minimum(self.cell, self.ranges[self.tiles, 1] - self.cy * self.cell)
+        area = (self.widths * self.heights).astype('float64')
+        self.area_p = area / area.sum()
+        self.loss = np.zeros(len(self.tiles))
+        self.seen = np.zeros(len(self.tiles), dtype=bool)
+        self.batches = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self.cdf = None
+
+    def cells(self, files, xs, ys):
+        nx_ny = np.array(self.grid)[files]
+        return (np.array(self.first_cell)[files] + (np.asarray(xs) // self.cell) * nx_ny[:, 1]
+                + np.asarray(ys) // self.cell)
+
+    def probabilities(self):
+        loss = self.loss.copy()
+        if self.seen.any():
+            loss[~self.seen] = loss[self.seen].mean()
+        z = loss / self.temperature
+        p = np.exp(z - z.max())
+        return (1 - self.uniform) * p / p.sum() + self.uniform * self.area_p
+
+    def sample(self, rng, n, per_patch=True):
+        """
+        :param per_patch: draw the cells of all the patches in one tile, drawn by the priorities of its cells
+        :return: (files, ux, uy) as StepSampler.sample
+        """
+        with self.lock:
+            if self.cdf is None:
+                self.cdf = np.cumsum(self.probabilities())
+            cdf = self.cdf
+        if per_patch:
+            cells = np.searchsorted(cdf, rng.random(n) * cdf[-1], side='right')
+        else:
+            tile = self.tiles[np.searchsorted(cdf, rng.random() * cdf[-1], side='right')]
+            start = self.first_cell[tile]
+            end = start + self.grid[tile][0] * self.grid[tile][1]
+            tile_cdf = cdf[start:end] - (cdf[start - 1] if start > 0 else 0.)
+            cells = start + np.searchsorted(tile_cdf, rng.random(n) * tile_cdf[-1], side='right')
+        cells = np.minimum(cells, len(cdf) - 1)
+        files = self.tiles[cells]
+        # random origin inside the cell, as a fraction of the range of the tile for gen_patches.crop_offsets
+        x = self.cx[cells] * self.cell + rng.random(n) * self.widths[cells]
+        y = self.cy[cells] * self.cell + rng.random(n) * self.heights[cells]
+        return files, x / self.ranges[files, 0], y / self.ranges[files, 1]
+
+    def record(self, files, xs, ys, batch):
+        # called by the generator with the crop origins and the arrays of every batch it yields
+        self.batches.append((self.cells(files, xs, ys), batch))
+
+    def update(self, cells, losses):
+        with self.lock:
+            for cell, loss in zip(cells, losses):
+                if self.seen[cell]:
+                    self.loss[cell] = self.decay * self.loss[cell] + (1 - self.decay) * loss
+                else:
+                    self.loss[cell] = loss
+                    self.seen[cell] = True
+            self.cdf = None
+
+    def stats(self):
+        seen = self.loss[self.seen]
+        return {'seen': int(self.seen.sum()), 'cells': len(self.loss),
+                'mean_loss': float(seen.mean()) if len(seen) else None,
+                'max_loss': float(seen.max()) if len(seen) else None}
+
+
+class HardExampleCallback(Callback):
+    """
+    Feeds the losses of the patches back to a HardExampleMiner. Every `every` batches the model is evaluated on the
+    last batch recorded by the generator, which costs a forward pass, and the losses of its patches update the cells
+    they were cropped from. The batch does not need to be the one just trained: the generator runs ahead of
+    fit_generator, any recent batch measures the current model.
+    """
+
+    def __init__(self, miner, every=4, report=1000):
+        super(HardExampleCallback, self).__init__()
+        self.miner = miner
+        self.every = every
+        self.report = report
+        self.n_batches = 0
+
+    def on_batch_end(self, batch, logs=None):
+        self.n_batches += 1
+        if self.n_batches % self.every or not self.miner.batches:
+            return
+        cells, (batch_x, batch_y, batch_y2) = self.miner.batches.pop()
+        pred, pred2 = self.model.predict_on_batch(batch_x)
+        self.miner.update(cells, patch_losses(batch_y, batch_y2, pred, pred2))
+        if self.n_batches % self.report < self.every:
+            print('\nhard example mining', self.miner.stats())
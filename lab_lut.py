@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import numpy as np
+from skimage.color import rgb2lab
+from skimage import exposure
+from quantize import quantize
+from stretch import block_percentiles
+
+# the tables are built once per dtype and shared by every process through the page cache
+LUT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'wnet')
+LUT_DTYPE = 'float32'
+# rows converted at a time, bounds the int32 indices and the output of the gather
+BLOCK_ROWS = 512
+
+_luts = {}
+_lock = threading.Lock()
+
+
+def normalize_lab(lab_img):
+    # L in [0, 100] and a, b in [-128, 128] to [0, 1], in place
+    lab_img[..., 0] = lab_img[..., 0]/100
+    lab_img[..., 1] = np.interp(lab_img[..., 1], (-128, 128), (0, 1))
+    lab_img[..., 2] = np.interp(lab_img[..., 2], (-128, 128), (0, 1))
+    return lab_img
+
+
+def lut_path(dtype=LUT_DTYPE):
+    return os.path.join(LUT_DIR, 'lab_lut_{}.npy'.format(np.dtype(dtype).name))
+
+
+def build_lut(dtype=LUT_DTYPE, path=None, r_block=16):
+    """
+    Normalized Lab of the 256^3 RGB values, row r * 65536 + g * 256 + b holding the Lab of (r, g, b), computed by
+    skimage and quantized to dtype (see quantize.py) as the images of rgb2lab.py are.
+    :return: path of the table, 192 MB in float32
+    """
+    path = path or lut_path(dtype)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    lut = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.dtype(dtype), shape=(256 ** 3, 3))
+    values = np.arange(256, dtype='uint8')
+    for r in range(0, 256, r_block):
+        rgb = np.stack(np.meshgrid(values[r:r + r_block], values, values, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+        lab = normalize_lab(rgb2lab(rgb)).reshape(-1, 3)
+        lut[r * 65536:(r + r_block) * 65536] = quantize(lab, dtype)
+    lut.flush()
+    del lut
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_lut(dtype=LUT_DTYPE):
+    # memory-mapped, built the first time
+    dtype = np.dtype(dtype).name
+    with _lock:
+        if dtype not in _luts:
+            if not os.path.isfile(lut_path(dtype)):
+                build_lut(dtype)
+            _luts[dtype] = np.load(lut_path(dtype), mmap_mode='r')
+        return _luts[dtype]
+
+
+def lab_from_uint8(img, dtype=LUT_DTYPE, block_rows=BLOCK_ROWS):
+    """
+    Normalized Lab of a uint8 RGB image by a gather in the table of dtype, equal to
+    quantize(normalize_lab(rgb2lab(img)), dtype).
+    """
+    lut = load_lut(dtype)
+    out = np.empty(img.shape[:2] + (3,), dtype=lut.dtype)
+    for x in range(0, img.shape[0], block_rows):
+        block = np.asarray(img[x:x + block_rows], dtype='int32')
+        index = (block[..., 0] << 16) | (block[..., 1] << 8) | block[..., 2]
+        out[x:x + block_rows] = np.take(lut, index, axis=0)
+    return out
+
+
+class LabReader(object):
+    """
+    Reads windows of a uint8 RGB image as the normalized Lab images of rgb2lab.py, stretched to the 2nd and 98th
+    percentiles of the whole image, for predict.predict_tiled on the raw images.
+    :param reader: tiled_tiff.TiledImage of the RGB image
+    """
+
+    def __init__(self, reader, dtype=LUT_DTYPE, block_rows=BLOCK_ROWS):
+        self.reader = reader
+        self.dtype = np.dtype(dtype)
+        self.shape = reader.shape[:2] + (3,)
+        dim_x, dim_y, n_bands = reader.shape
+
+        def blocks():
+            for x in range(0, dim_x, block_rows):
+                yield reader[x:min(x + block_rows, dim_x), :]
+
+        self.p2, self.p98 = block_percentiles(blocks, (2, 98), reader.dtype, dim_x * dim_y * n_bands)
+
+    def __getitem__(self, key):
+        window = exposure.rescale_intensity(self.reader[key], in_range=(self.p2, self.p98))
+        lab = lab_from_uint8(window, self.dtype)
+        # the windows past the end of the image stay zero, as the padding of the Lab images
+        x0, y0 = key[0].start or 0, key[1].start or 0
+        lab[max(self.shape[0] - x0, 0):] = 0
+        lab[:, max(self.shape[1] - y0, 0):] = 0
+        return lab
+
+
+if __name__ == '__main__':
+    # python lab_lut.py [dtype ...]
+    for dtype in sys.argv[1:] or [LUT_DTYPE]:
+        print(build_lut(dtype))
@@ -6,30 +6,13 @@ import tensorflow as tf
 
 import tifffile as tiff
 import numpy as np
+from palette import mask_from_picture
 from os import listdir
 from os.path import isfile, join
 
 epsilon = 1e-5
 smooth = 1
 
-def mask_from_picture(picture):
-    colors = {
-    (255, 255, 255): 0,   #imp surface
-    (255, 255, 0): 1,     #car
-    (0, 0, 255): 2,       #building
-    (255, 0, 0): 3,       #background
-    (0, 255, 255): 4,     #low veg
-    (0, 255, 0): 5        #tree
-    }
-    picture = picture.transpose([1,2,0])
-    mask = np.ndarray(shape=(256*256*256), dtype='int32')
-    mask[:] = -1
-    for rgb, idx in colors.items():
-        rgb = rgb[0] * 65536 + rgb[1] * 256 + rgb[2]
-        mask[rgb] = idx
-    picture = picture.dot(np.array([65536, 256, 1], dtype='int32'))
-    return mask[picture]
-
 def get_n_instances(dataset):
     if dataset == 'potsdam':
         path = './datasets/potsdam/5_Labels_all/'
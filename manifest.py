@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tifffile as tiff
+
+MANIFEST_NAME = 'manifest.json'
+N_WORKERS = 8
+
+# manifests already read by this process, by directory
+_manifests = {}
+_lock = threading.Lock()
+
+
+def manifest_path(path):
+    # one manifest per directory of images or masks, next to the files
+    return os.path.join(os.path.dirname(os.path.abspath(path)), MANIFEST_NAME)
+
+
+def file_checksum(path, chunk_size=2 ** 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def file_record(path, checksum=True):
+    """
+    Record of a tif read from its header only, the pixels are not decoded.
+    :return: dict with shape, dtype, bands, bytes, mtime and md5 (None without checksum)
+    """
+    st = os.stat(path)
+    with tiff.TiffFile(path) as f:
+        series = f.series[0]
+        shape = list(series.shape)
+        dtype = str(np.dtype(series.dtype))
+    return {'shape': shape, 'dtype': dtype, 'bands': shape[2] if len(shape) > 2 else 1, 'bytes': st.st_size,
+            'mtime': st.st_mtime, 'md5': file_checksum(path) if checksum else None}
+
+
+def _is_fresh(record, path, checksum):
+    if record is None or (checksum and record['md5'] is None):
+        return False
+    st = os.stat(path)
+    return record['bytes'] == st.st_size and record['mtime'] == st.st_mtime
+
+
+def load_manifest(path):
+    """
+    :param path: any file of the directory of the manifest
+    :return: dict from the file names of the directory to their records, empty if there is no manifest yet
+    """
+    directory = os.path.dirname(manifest_path(path))
+    with _lock:
+        if directory not in _manifests:
+            records = {}
+            if os.path.isfile(manifest_path(path)):
+                with open(manifest_path(path)) as f:
+                    records = json.load(f)
+            _manifests[directory] = records
+        return _manifests[directory]
+
+
+def save_manifest(path, records):
+    new_path = manifest_path(path)
+    tmp_path = '{}.{}.tmp'.format(new_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(records, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, new_path)
+
+
+def update_manifest(paths, checksum=True, n_workers=N_WORKERS):
+    """
+    Records the tifs of paths in the manifests of their directories. Only the files that are new or whose size or
+    modification time changed are read, by n_workers threads.
+    :return: list of the records of paths
+    """
+    stale = [p for p in paths if not _is_fresh(load_manifest(p).get(os.path.basename(p)), p, checksum)]
+    if stale:
+        with ThreadPoolExecutor(n_workers) as pool:
+            records = list(pool.map(lambda p: file_record(p, checksum), stale))
+        for p, record in zip(stale, records):
+            load_manifest(p)[os.path.basename(p)] = record
+        for p in dict((manifest_path(p), p) for p in stale).values():
+            save_manifest(p, load_manifest(p))
+    return [load_manifest(p)[os.path.basename(p)] for p in paths]
+
+
+def dataset_records(path_template, ids, checksum=True, n_workers=N_WORKERS):
+    return update_manifest([path_template.format(id) for id in ids], checksum, n_workers)
+
+
+def get_shape(path):
+    # without checksum, so a file missing from the manifest only has its header read
+    return tuple(update_manifest([path], checksum=False)[0]['shape'])
+
+
+def files_weights(path_template, ids):
+    """
+    Probability of drawing each tile for generator.image_generator, proportional to its area.
+    """
+    areas = np.array([r['shape'][0] * r['shape'][1] for r in dataset_records(path_template, ids)], dtype='float64')
+    return areas / areas.sum()
+
+
+if __name__ == '__main__':
+    # python manifest.py <tif> [<tif> ...]
+    for path, record in zip(sys.argv[1:], update_manifest(sys.argv[1:])):
+        print(path, record)
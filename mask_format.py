@@ -0,0 +1,51 @@
+import numpy as np
+
+# formats of the masks on disk:
+# 'onehot' one plane per class, as written before
+# 'index' uint8 class index map with shape (x_sz, y_sz), NO_CLASS for the pixels of no class
+# 'soft' uint8 fractions of the classes in fixed point, value / SOFT_SCALE
+FORMATS = ('onehot', 'index', 'soft')
+NO_CLASS = 255
+SOFT_SCALE = 255
+
+
+def to_soft(mask):
+    # fractions in [0, 1] to uint8, the error of a fraction is at most 1 / (2 * SOFT_SCALE)
+    return np.round(np.asarray(mask) * SOFT_SCALE).astype('uint8')
+
+
+def expand(mask, n_classes, mask_format='onehot', dtype='float32'):
+    """
+    One-hot or fractions of a mask or a batch of masks stored in mask_format, meant for the cropped batches only.
+    :param mask: class index maps with shape (..., x_sz, y_sz) for 'index', planes with shape (..., n_classes) else
+    :return: ndarray with shape (..., n_classes)
+    """
+    if mask_format == 'index':
+        if mask.shape[-1] == 1:
+            # the windows of tiled_tiff.TiledImage keep a band axis
+            mask = mask[..., 0]
+        return (mask[..., None] == np.arange(n_classes, dtype='uint8')).astype(dtype)
+    if mask_format == 'soft':
+        return mask.astype(dtype) / SOFT_SCALE
+    if mask_format == 'onehot':
+        return mask
+    raise ValueError('unknown mask format {}'.format(mask_format))
+
+
+def mask_planes(mask_format, n_classes):
+    # planes_fn of class_index.load_or_build for the masks of mask_format
+    if mask_format == 'index':
+        return lambda mask: expand(mask, n_classes, mask_format, 'uint8')
+    return None
+
+
+def planes_key(mask_format, n_classes):
+    # key of the planes of mask_planes, for class_index.load_or_build
+    if mask_format == 'index':
+        return '{} {}'.format(mask_format, n_classes)
+    return mask_format
+
+
+def nodata_value(mask_format):
+    # value of the pixels of no class, for class_index.load_valid
+    return NO_CLASS if mask_format == 'index' else 0
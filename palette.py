@@ -0,0 +1,124 @@
+import threading
+import numpy as np
+
+# colours of the classes of the RGB ground truths, the colour of class i at row i
+PALETTES = {
+    'potsdam': [(255, 255, 255),   # imp surface
+                (255, 255, 0),     # car
+                (0, 0, 255),       # building
+                (255, 0, 0),       # background
+                (0, 255, 255),     # low veg
+                (0, 255, 0)],      # tree
+    # ground truths without boundaries, the eroded boundaries are black
+    'potsdam_boundary': [(255, 255, 255), (255, 255, 0), (0, 0, 255), (255, 0, 0), (0, 255, 255), (0, 255, 0),
+                         (0, 0, 0)],
+    'dstl': [(255, 0, 0),      # building
+             (0, 255, 0),      # imp surface
+             (0, 0, 255),      # trees
+             (255, 255, 0),    # low vegetation
+             (0, 255, 255),    # water
+             (255, 0, 255),    # car
+             (0, 0, 0)],       # background
+    'dstl11': [(255, 0, 0),    # building
+               (0, 255, 0),    # misc manmade structure
+               (0, 0, 255),    # road
+               (255, 255, 0),  # track
+               (0, 255, 255),  # tree
+               (255, 0, 255),  # crops
+               (255, 125, 0),  # waterway
+               (125, 255, 0),  # standing water
+               (0, 255, 125),  # vehicle large
+               (0, 125, 255),  # vehicle small
+               (0, 0, 0)],     # background
+}
+# rows decoded at a time, bounds the uint32 indices
+BLOCK_ROWS = 1024
+
+_luts = {}
+_lock = threading.Lock()
+
+
+def colors(palette='potsdam'):
+    return np.array(PALETTES[palette], dtype='uint8')
+
+
+def get_lut(palette='potsdam'):
+    """
+    Class of every packed colour r * 65536 + g * 256 + b, -1 for the colours of no class. 16 MB of int8, built once
+    per process and palette.
+    """
+    with _lock:
+        if palette not in _luts:
+            lut = np.full(256 ** 3, -1, dtype='int8')
+            lut[pack(colors(palette))] = np.arange(len(PALETTES[palette]))
+            _luts[palette] = lut
+        return _luts[palette]
+
+
+def pack(picture):
+    # uint32 index of the colours of a (..., 3) picture
+    picture = np.asarray(picture).astype('uint32')
+    return (picture[..., 0] << 16) | (picture[..., 1] << 8) | picture[..., 2]
+
+
+def decode(picture, palette='potsdam', block_rows=BLOCK_ROWS):
+    """
+    :param picture: RGB ground truth with shape (x_sz, y_sz, 3)
+    :return: int8 class map with shape (x_sz, y_sz), -1 where the colour is of no class
+    """
+    lut = get_lut(palette)
+    classes = np.empty(picture.shape[:2], dtype='int8')
+    for x in range(0, picture.shape[0], block_rows):
+        classes[x:x + block_rows] = np.take(lut, pack(picture[x:x + block_rows]))
+    return classes
+
+
+def encode(classes, palette='potsdam'):
+    """
+    :param classes: integer class map with shape (x_sz, y_sz)
+    :return: uint8 RGB picture with shape (x_sz, y_sz, 3)
+    """
+    return np.take(colors(palette), classes, axis=0)
+
+
+def class_map(mask, axis=-1, block_rows=BLOCK_ROWS):
+    """
+    Argmax of class probabilities by blocks of rows, without the int64 map of a whole image.
+    :param mask: ndarray of shape (x_sz, y_sz, n_classes), or with the classes along axis
+    :return: uint8 class map with shape (x_sz, y_sz)
+    """
+    mask = np.moveaxis(mask, axis, -1)
+    classes = np.empty(mask.shape[:2], dtype='uint8')
+    for x in range(0, mask.shape[0], block_rows):
+        classes[x:x + block_rows] = np.argmax(mask[x:x + block_rows], axis=-1)
+    return classes
+
+
+def render(mask, palette='potsdam', axis=-1, block_rows=BLOCK_ROWS):
+    """
+    Colours a prediction with one argmax and one palette gather per block of rows.
+    :param mask: class probabilities with the classes along axis, or an integer class map with shape (x_sz, y_sz)
+    :return: uint8 RGB picture with shape (x_sz, y_sz, 3)
+    """
+    if mask.ndim == 2:
+        return encode(mask, palette)
+    mask = np.moveaxis(mask, axis, -1)
+    picture = np.empty(mask.shape[:2] + (3,), dtype='uint8')
+    for x in range(0, mask.shape[0], block_rows):
+        picture[x:x + block_rows] = encode(np.argmax(mask[x:x + block_rows], axis=-1), palette)
+    return picture
+
+
+def picture_from_mask(mask, palette='potsdam'):
+    # channels first, as the copies this replaces, uint8 instead of float64
+    return render(mask, palette, axis=0).transpose([2, 0, 1])
+
+
+def mask_from_picture(picture, palette='potsdam'):
+    # channels first, as the copies this replaces
+    return decode(picture.transpose([1, 2, 0]), palette)
+
+
+def one_hot(classes, n_classes, dtype='uint8'):
+    # the classes of no class (-1) are all zeros
+    return (classes[..., None] == np.arange(n_classes)).astype(dtype)
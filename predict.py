@@ -5,11 +5,16 @@ import os
 #import tensorflow as tf
 import sys
 import numpy as np
+from palette import mask_from_picture, picture_from_mask
 import matplotlib.pyplot as plt
 import tifffile as tiff
 import cv2
 from train_net import weights_path, get_model, path_img, PATCH_SZ, N_CLASSES, DATASET, MODEL, ID
 from get_step import find_step
+from tiled_tiff import open_tiled
+from manifest import get_shape
+from class_index import load_valid, is_nodata
+from lab_lut import LabReader
 from scipy import stats
 from sklearn.metrics import classification_report, accuracy_score
 import gc
@@ -46,41 +51,41 @@ def predict(x, model, patch_sz=160, n_classes=5, step = 142):
     i = reconstruct_patches(predict[1], (dim_x, dim_y, 3), step)
     return prediction, i
 
-def picture_from_mask(mask):
-    colors = {
-        0: [255, 255, 255],   #imp surface
-        1: [255, 255, 0],     #car
-        2: [0, 0, 255],       #building
-        3: [255, 0, 0],       #background
-        4: [0, 255, 255],     #low veg
-        5: [0, 255, 0]        #tree
-    }
+# predict from the raw uint8 RGB images, converted to Lab window by window with the lookup table of lab_lut.py
+LAB_FROM_RGB = False
+# skip the windows without valid pixels, from the index of class_index.load_valid built next to the images
+SKIP_NODATA = False
 
-    mask_ind = np.argmax(mask, axis=0)
-    pict = np.empty(shape=(3, mask.shape[1], mask.shape[2]))
-    for cl in range(6):
-      for ch in range(3):
-        pict[ch,:,:] = np.where(mask_ind == cl, colors[cl][ch], pict[ch,:,:])
-    return pict
-
-def mask_from_picture(picture):
-  colors = {
-      (255, 255, 255): 0,   #imp surface
-      (255, 255, 0): 1,     #car
-      (0, 0, 255): 2,       #building
-      (255, 0, 0): 3,       #background
-      (0, 255, 255): 4,     #low veg
-      (0, 255, 0): 5        #tree
-  }
-  picture = picture.transpose([1,2,0])
-  mask = np.ndarray(shape=(256*256*256), dtype='int32')
-  mask[:] = -1
-  for rgb, idx in colors.items():
-    rgb = rgb[0] * 65536 + rgb[1] * 256 + rgb[2]
-    mask[rgb] = idx
-
-  picture = picture.dot(np.array([65536, 256, 1], dtype='int32'))
-  return mask[picture]
+def predict_tiled(reader, model, patch_sz=160, n_classes=5, step = 142, size = None, batch_size = 1, valid = None):
+    """
+    Sliding window prediction reading only the windows of the image, the windows past the end of the image are padded
+    with zeros.
+    :param reader: TiledImage of the image
+    :param size: (dim_x, dim_y) covered by the windows, defaults to the size of the image
+    :param valid: valid-pixel index of the image (class_index.load_valid), the windows without valid pixels are not
+    predicted and their pixels get zero probabilities
+    """
+    dim_x, dim_y = size if size is not None else reader.shape[:2]
+    windows = list(product(range(0, dim_x - patch_sz + 1, step), range(0, dim_y - patch_sz + 1, step)))
+    if valid is not None:
+        n_windows = len(windows)
+        windows = [(i, j) for i, j in windows if not is_nodata(valid, i, j, patch_sz, patch_sz)]
+        print('nodata windows skipped', n_windows - len(windows))
+    prediction = np.zeros((dim_x, dim_y, n_classes))
+    image_prediction = np.zeros((dim_x, dim_y, 3))
+    patch_count = np.zeros((dim_x, dim_y, 1))
+    for b in range(0, len(windows), batch_size):
+        batch_windows = windows[b:b + batch_size]
+        patches = np.array([reader[i:i + patch_sz, j:j + patch_sz] for i, j in batch_windows])
+        predict = model.predict(patches, batch_size = batch_size)
+        for (i, j), p_mask, p_img in zip(batch_windows, predict[0], predict[1]):
+            prediction[i:i + patch_sz, j:j + patch_sz] += p_mask
+            image_prediction[i:i + patch_sz, j:j + patch_sz] += p_img
+            patch_count[i:i + patch_sz, j:j + patch_sz] += 1
+    print('MAX time seen', np.amax(patch_count))
+    if valid is not None:
+        patch_count[patch_count == 0] = 1
+    return prediction / patch_count, image_prediction / patch_count
 
 def predict_all(step, path_img):
     model = get_model()
@@ -99,16 +104,23 @@ def predict_all(step, path_img):
     if not os.path.exists(path_results): os.makedirs(path_results)
     for test_id in test:
         path_img = path_i.format(test_id)
-        img = tiff.imread(path_img)
+        img = open_tiled(path_img)
+        if LAB_FROM_RGB:
+            img = LabReader(img)
         path_mask = path_m.format(test_id)
+        # shapes from the manifests, before decoding the label
+        size = get_shape(path_img)[:2]
+        if get_shape(path_mask)[:2] != size:
+            raise ValueError('{} has shape {}, {} has {}'.format(path_mask, get_shape(path_mask), path_img, size))
         label = tiff.imread(path_mask).transpose([2,0,1])
         gt = mask_from_picture(label)
         if DATASET == 'vaihingen':
             step, x_padding, y_padding, x_original, y_original = find_step(img, PATCH_SZ, test_id)
             print('Step: ', step, x_padding, y_padding, x_original, y_original)
-            img = cv2.copyMakeBorder(img, 0, x_padding-x_original, 0, y_padding-y_original, cv2.BORDER_CONSTANT)
-            img = np.expand_dims(img, axis = 2)
-        mask, previsao = predict(img, model, patch_sz=PATCH_SZ, n_classes=N_CLASSES, step = step)
+            # the windows past the end of the image are zero, as with cv2.copyMakeBorder(..., cv2.BORDER_CONSTANT)
+            size = (x_padding, y_padding)
+        mask, previsao = predict_tiled(img, model, patch_sz=PATCH_SZ, n_classes=N_CLASSES, step = step, size = size,
+                                       valid = load_valid(path_img) if SKIP_NODATA else None)
         print(mask.shape, p)
         if DATASET == 'vaihingen':
             mask = mask.transpose([1,2,0])
@@ -5,6 +5,7 @@ import os
 #import tensorflow as tf
 import sys
 import numpy as np
+from palette import picture_from_mask, class_map
 import matplotlib.pyplot as plt
 import tifffile as tiff
 import cv2
@@ -55,47 +56,9 @@ def predict(x, model, patch_sz=160, n_classes=5, step = 142):
     return prediction, image_prediction
 
 
-def picture_from_mask(mask):
-    colors = {
-        6: [0, 0, 0],     # background
-        0: [255, 0, 0],    # building
-        1: [0, 255, 0],    # imp surface
-        2: [0, 0, 255],    # trees
-        3: [255, 255, 0],  # low vegetation
-        4: [0, 255, 255],  # water
-        5: [255, 0, 255]  # car
-    }
-
-    mask_ind = np.argmax(mask, axis=0)
-    pict = np.empty(shape=(3, mask.shape[1], mask.shape[2]))
-    for cl in range(7):
-      for ch in range(3):
-        pict[ch,:,:] = np.where(mask_ind == cl, colors[cl][ch], pict[ch,:,:])
-    return pict
-
-def mask_from_picture(picture):
-    colors = {
-        (255, 0, 0): 0,  # building
-        (0, 255, 0): 1,  # imp surface
-        (0, 0, 255): 2,  # trees
-        (255, 255, 0): 3,  # low vegetation
-        (0, 255, 255): 4,  # water
-        (255, 0, 255): 5,  # car
-        (0, 0, 0): 6  # background
-    }
-    picture = picture.transpose([1,2,0])
-    mask = np.ndarray(shape=(256*256*256), dtype='int32')
-    mask[:] = -1
-    for rgb, idx in colors.items():
-        rgb = rgb[0] * 65536 + rgb[1] * 256 + rgb[2]
-        mask[rgb] = idx
-    picture = picture.dot(np.array([65536, 256, 1], dtype='int32'))
-    return mask[picture]
-
 def gt_from_mask(mask):
-    mask = picture_from_mask(mask.transpose([2, 0, 1])).astype(int)
-    gt = mask_from_picture(mask)
-    return gt
+    # every class has its own colour, so colouring and decoding the one-hot mask is its argmax
+    return class_map(mask)
 
 
 def predict_all(step, path_img):
@@ -115,7 +78,7 @@ def predict_all(step, path_img):
         img = tiff.imread(path_img)
         path_mask = path_m.format(test_id)
         gt = tiff.imread(path_mask)
-        tiff.imsave(path_results+'/mask_true_{}.tif', np.argmax(picture_from_mask(gt.transpose([2,0,1])), axis = 0))
+        tiff.imsave(path_results+'/mask_true_{}.tif', np.argmax(picture_from_mask(gt.transpose([2,0,1]), 'dstl'), axis = 0))
         gt = gt_from_mask(gt)
         step, x_padding, y_padding, x_original, y_original = find_step(img, PATCH_SZ, test_id)
         print('Step: ', step, x_padding, y_padding, x_original, y_original)
@@ -126,7 +89,7 @@ def predict_all(step, path_img):
         mask = mask[:x_original, :y_original, ]
         mask = mask.transpose([2,0,1])
 
-        prediction = picture_from_mask(mask)
+        prediction = picture_from_mask(mask, 'dstl')
         target_labels = ['buildings', 'imp surface', 'trees', 'low vegetation', 'water', 'car', 'background']
         labels = list(range(len(target_labels)))
         y_true = gt.ravel()
@@ -141,7 +104,7 @@ def predict_all(step, path_img):
         print(report)
         print('\nAccuracy', accuracy)
         accuracy_all.append(accuracy)
-        tiff.imsave(path_results + '/mask_{}.tif'.format(test_id), picture_from_mask(mask))
+        tiff.imsave(path_results + '/mask_{}.tif'.format(test_id), picture_from_mask(mask, 'dstl'))
         tiff.imsave(path_results + '/image_{}.tif'.format(test_id), image_predict)
         gc.collect()
         gc.collect()
@@ -0,0 +1,173 @@
+import os
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import tifffile as tiff
+from tqdm import tqdm
+
+# steps in the order they run, each one reads the outputs of the previous ones
+STEPS = ['lab', 'l', 'mask', 'rotcrop']
+
+# directories of the datasets, as in rgb2lab.py, gen_l.py, get_mask.py and rotate_crop.py
+DATASETS = {
+    'potsdam': {'images': '/home/mdias/datasets/potsdam/Images/',
+                'labels': '/home/mdias/datasets/potsdam/5_Labels_all/',
+                'lab': '/home/mdias/datasets/potsdam/Images_lab_hist/',
+                'l': '/home/mdias/datasets/potsdam/Images_l/',
+                'y_true': '/home/mdias/datasets/potsdam/y_true/',
+                'masks': '/home/mdias/datasets/potsdam/Masks/'},
+    'vaihingen': {'images': '/home/mdias/datasets/vaihingen/Images/',
+                  'labels': '/home/mdias/datasets/vaihingen/Ground_Truth/',
+                  'lab': '/home/mdias/datasets/vaihingen/Images_lab_hist/',
+                  'l': '/home/mdias/datasets/vaihingen/Images_l/',
+                  'y_true': '/home/mdias/datasets/vaihingen/y_true/',
+                  'masks': '/home/mdias/datasets/vaihingen/Masks/'},
+}
+
+# the rotated crops of top_mosaic_09cm_area1.tif are top_mosaic_09cm_area_rc_1.tif, as written by rotate_crop.py, the
+# ids '_rc_1' of train_net.py with the same template
+ROTCROP_INFIX = '_rc_'
+
+
+def imsave_atomic(path, img):
+    # an interrupted write leaves no partial tif behind, so the outputs that exist are complete
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    tiff.imsave(tmp_path, img)
+    os.replace(tmp_path, path)
+
+
+def rotcrop_name(f):
+    name, ext = os.path.splitext(f)
+    prefix, id = re.match(r'(.*?)(\d*)$', name).groups()
+    return prefix + ROTCROP_INFIX + id + ext
+
+
+def is_rotcrop(f):
+    return re.search(ROTCROP_INFIX + r'\d*$', os.path.splitext(f)[0]) is not None
+
+
+def list_tifs(path):
+    return sorted(f for f in os.listdir(path) if f.endswith('.tif') and not is_rotcrop(f))
+
+
+def step_tasks(step, dirs, ids=None):
+    """
+    :param ids: file names to process, every tif of the input directory by default
+    :return: list of (step, inputs, outputs) of the files of the step
+    """
+    if step == 'lab':
+        files = ids or list_tifs(dirs['images'])
+        return [(step, [dirs['images'] + f], [dirs['lab'] + f]) for f in files]
+    if step == 'l':
+        files = ids or list_tifs(dirs['lab'])
+        return [(step, [dirs['lab'] + f], [dirs['l'] + f]) for f in files]
+    if step == 'mask':
+        files = ids or list_tifs(dirs['labels'])
+        return [(step, [dirs['labels'] + f], [dirs['y_true'] + f]) for f in files]
+    if step == 'rotcrop':
+        files = ids or list_tifs(dirs['labels'])
+        return [(step, [dirs['lab'] + f, dirs['l'] + f, dirs['labels'] + f],
+                 [dirs['lab'] + rotcrop_name(f), dirs['l'] + rotcrop_name(f), dirs['masks'] + rotcrop_name(f)])
+                for f in files]
+    raise ValueError('unknown step {}'.format(step))
+
+
+def run_task(task, dtype='float64', block_rows=None, stretch_range=None, mask_format='onehot'):
+    # imported here so the workers only load the libraries of their steps
+    step, inputs, outputs = task
+    if step == 'lab' and block_rows:
+        from rgb2lab import lab_image_chunked
+        lab_image_chunked(inputs[0], outputs[0], dtype, block_rows, stretch_range)
+    elif step == 'lab':
+        from rgb2lab import lab_image
+        imsave_atomic(outputs[0], lab_image(tiff.imread(inputs[0]), dtype, stretch_range))
+    elif step == 'l':
+        from gen_l import l_image
+        imsave_atomic(outputs[0], l_image(tiff.imread(inputs[0])))
+    elif step == 'mask':
+        from get_mask import y_true_image
+        imsave_atomic(outputs[0], y_true_image(tiff.imread(inputs[0])))
+    elif step == 'rotcrop':
+        from rotate_crop import rotate_crop_images
+        images = rotate_crop_images(*[tiff.imread(p) for p in inputs], mask_format=mask_format)
+        for path, img in zip(outputs, images):
+            imsave_atomic(path, img)
+    return task
+
+
+def run_step(step, dirs, ids=None, n_workers=4, overwrite=False, dtype='float64', block_rows=None, stretch='image',
+             mask_format='onehot'):
+    """
+    Runs the files of the step in a pool of n_workers processes. The files whose outputs all exist are skipped, so
+    a step interrupted resumes where it stopped.
+    :param block_rows: convert the Lab images in blocks of block_rows rows, see rgb2lab.lab_image_chunked
+    :param stretch: 'image' stretches every image to its own 2nd and 98th percentiles, 'dataset' to the percentiles of
+        all the images of the step, from their histograms (see stretch.dataset_histogram)
+    :param mask_format: 'onehot' or 'index' masks of the rotcrop step, see mask_format.py
+    """
+    tasks = step_tasks(step, dirs, ids)
+    todo = [t for t in tasks if overwrite or not all(os.path.isfile(p) for p in t[2])]
+    for task in todo:
+        for path in task[2]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    print('{}: {} files, {} done before'.format(step, len(tasks), len(tasks) - len(todo)))
+    stretch_range = None
+    if step == 'lab' and stretch == 'dataset' and todo:
+        from stretch import dataset_histogram
+        # over all the images, so a resumed step stretches as the files done before
+        stretch_range = tuple(float(p) for p in dataset_histogram([t[1][0] for t in tasks], n_workers=n_workers)
+                              .percentiles((2, 98)))
+        print('lab: dataset stretch range {}'.format(stretch_range))
+    if step == 'lab' and todo:
+        import rgb2lab
+        with tiff.TiffFile(todo[0][1][0]) as tif:
+            uint8_images = tif.series[0].dtype == 'uint8'
+        if rgb2lab.USE_LUT and uint8_images:
+            # the Lab table is built once here, the workers only map it (see lab_lut.load_lut)
+            from lab_lut import load_lut
+            load_lut(dtype)
+    if n_workers <= 1:
+        for task in tqdm(todo, desc=step):
+            run_task(task, dtype, block_rows, stretch_range, mask_format)
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [pool.submit(run_task, task, dtype, block_rows, stretch_range, mask_format) for task in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc=step):
+            # raises the exceptions of the workers
+            future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Preprocesses the tiles of a dataset: Lab conversion (lab), L '
+                                                 'channel (l), class index ground truth (mask) and 45 degree rotated '
+                                                 'crops (rotcrop).')
+    parser.add_argument('--dataset', choices=sorted(DATASETS), default='vaihingen',
+                        help='default directories, changed by the options below')
+    parser.add_argument('--steps', nargs='+', choices=STEPS, default=STEPS)
+    for key in ('images', 'labels', 'lab', 'l', 'y_true', 'masks'):
+        parser.add_argument('--' + key.replace('_', '-'), dest=key, help='directory of the {} files'.format(key))
+    parser.add_argument('--ids', nargs='+', help='file names to process, all the tifs by default')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float16', 'uint8'],
+                        help='dtype of the Lab images, see quantize.py')
+    parser.add_argument('--block-rows', type=int, default=None,
+                        help='convert the Lab images by blocks of rows with bounded memory, for very large scenes')
+    parser.add_argument('--stretch', choices=['image', 'dataset'], default='image',
+                        help='stretch the Lab images to the percentiles of each image or of the whole dataset')
+    parser.add_argument('--mask-format', choices=['onehot', 'index'], default='onehot',
+                        help='write the rotated masks one-hot or as uint8 class index maps (train_net.MASK_FORMAT)')
+    parser.add_argument('--overwrite', action='store_true', help='redo the files already written')
+    args = parser.parse_args(argv)
+
+    dirs = dict(DATASETS[args.dataset])
+    for key in dirs:
+        if getattr(args, key) is not None:
+            dirs[key] = os.path.join(getattr(args, key), '')
+    for step in STEPS:
+        if step in args.steps:
+            run_step(step, dirs, args.ids, args.workers, args.overwrite, args.dtype, args.block_rows,
+                     args.stretch, args.mask_format)
+
+
+if __name__ == '__main__':
+    main()
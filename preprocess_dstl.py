@@ -5,9 +5,14 @@ import tifffile as tiff
 import numpy as np
 #from osgeo import gdal
 from tqdm import tqdm
-from skimage.color import rgb2lab
-from skimage import exposure
 import cv2
+from rgb2lab import lab_image
+from stretch import dataset_histogram
+
+# 'uint8' or 'float16' writes quantized images, 8 or 4 times smaller than float64 (see wnet_model(uint8_inputs=True))
+OUTPUT_DTYPE = 'float64'
+# 'dataset' stretches all the scenes to the same percentiles, from the histograms of stretch.py, 'image' each to its own
+STRETCH = 'image'
 
 
 def listdir_nohidden(path):
@@ -30,15 +35,16 @@ for the_file in os.listdir(new_path_img):
             os.unlink(file_path)
     except Exception as e:
         print(e)
-        
+
+stretch_range = None
+if STRETCH == 'dataset':
+    stretch_range = tuple(dataset_histogram([path_img.format(f) for f in image_ids]).percentiles((2, 98)))
+    print('stretch range', stretch_range)
+
 for f in image_ids:
     print(f)
     img = tiff.imread(path_img.format(f))
-    p2, p98 = np.percentile(img, (2, 98))
-    new_img = exposure.rescale_intensity(img, in_range=(p2, p98))
-    lab_img = rgb2lab(new_img)
-    lab_img[:, :, 0] = lab_img[:, :, 0] / 100
-    lab_img[:, :, 1] = np.interp(lab_img[:, :, 1], (-128, 128), (0, 1))
-    lab_img[:, :, 2] = np.interp(lab_img[:, :, 2], (-128, 128), (0, 1))
+    # uint8 images go through the lookup table of lab_lut.py
+    lab_img = lab_image(img, OUTPUT_DTYPE, stretch_range)
     print(np.max(lab_img), np.min(lab_img))
     tiff.imsave(new_path_img.format(f), lab_img)
@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def quantize(img, dtype='uint8'):
+    """
+    Compact copy of an image for storage and transport.
+    :param img: float image in [0, 1] (normalized Lab, img/255, ...), or an integer mask
+    :param dtype: 'uint8' stores the float images as round(img * 255), 'float16' as half floats, integer masks are
+    only cast
+    """
+    if not np.issubdtype(img.dtype, np.floating):
+        return img.astype(dtype)
+    if np.dtype(dtype) == np.uint8:
+        return np.round(np.clip(img, 0, 1) * 255).astype('uint8')
+    return img.astype(dtype)
+
+
+def dequantize(img, dtype='float32'):
+    # inverse of quantize, for the places the images cannot be scaled in the graph of the model
+    if np.asarray(img).dtype == np.uint8:
+        return img.astype(dtype) / 255
+    return img.astype(dtype)
@@ -8,33 +8,90 @@ from skimage.color import rgb2lab
 from skimage import exposure
 import cv2
 from PIL import Image
+from quantize import quantize
+from stretch import block_percentiles, percentiles, is_exact, image_histogram
+from tiled_tiff import open_tiled
+from lab_lut import normalize_lab, lab_from_uint8
 
+# 'uint8' or 'float16' writes quantized images, 8 or 4 times smaller than float64 (see wnet_model(uint8_inputs=True))
+OUTPUT_DTYPE = 'float64'
+# convert the uint8 images with the lookup table of lab_lut.py, same output without the float conversion of skimage
+USE_LUT = True
+# rows converted at a time by lab_image_chunked, about 200 MB of float64 temporaries for 6000 pixel wide rows
+BLOCK_ROWS = 512
 
 
-dataset = input('Potsdam (p) or Vaihingen (v) dataset? ')
-while True:
-    if dataset == 'p':
-        path_img = '/home/mdias/datasets/potsdam/Images/'
-        new_path_img = '/home/mdias/datasets/potsdam/Images_lab_hist/'
-        break
-    elif dataset == 'v':
-        path_img = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Images/'
-        new_path_img = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Images_l_eq_hist/'
-        break
+def lab_image(img, dtype='float64', stretch_range=None):
+    """
+    Stretches the RGB image to its 2nd and 98th percentiles and converts it to Lab normalized to [0, 1].
+    :param dtype: dtype of the output, see quantize.py
+    :param stretch_range: (p2, p98) to stretch to instead of the percentiles of the image, e.g. of the whole dataset
+        from stretch.dataset_histogram
+    """
+    p2, p98 = stretch_range if stretch_range is not None else percentiles(img, (2, 98))
+    return lab_block(img, p2, p98, dtype)
+
+
+def lab_block(img, p2, p98, dtype='float64'):
+    # every operation is per pixel, so converting row blocks gives the same pixels as converting the whole image
+    new_img = exposure.rescale_intensity(img, in_range=(p2, p98))
+    if USE_LUT and new_img.dtype == np.uint8:
+        return lab_from_uint8(new_img, dtype)
+    lab_img = normalize_lab(rgb2lab(new_img))
+    #lab_img = np.expand_dims(lab_img[:, :, 0], axis=2)
+    return quantize(lab_img, dtype)
+
+
+def lab_image_chunked(path, new_path, dtype=OUTPUT_DTYPE, block_rows=BLOCK_ROWS, stretch_range=None):
+    """
+    Same output as lab_image, converting the image in blocks of block_rows rows written straight to new_path, so the
+    memory used does not grow with the size of the image. The image is read through tiled_tiff.open_tiled: write its
+    tiled copy first for compressed tifs, that cannot be memory-mapped. The histogram of 8 and 16 bit images is stored
+    next to them (see stretch.image_histogram), so the percentiles of a converted image are not read again.
+    """
+    reader = open_tiled(path)
+    dim_x, dim_y, n_bands = reader.shape
+
+    def blocks():
+        for x in range(0, dim_x, block_rows):
+            yield reader[x:min(x + block_rows, dim_x), :]
+
+    if stretch_range is not None:
+        p2, p98 = stretch_range
+    elif is_exact(reader.dtype):
+        p2, p98 = image_histogram(path, block_rows=block_rows).percentiles((2, 98))
     else:
-        dataset = input('p or v?')
-
-if not os.path.exists(new_path_img): os.makedirs(new_path_img)
-files = [f for f in listdir(path_img) if isfile(join(path_img, f))]
-for f in tqdm(files):
-    if '.tif' in f:
-        img = tiff.imread(path_img+f)
-        p2, p98 = np.percentile(img, (2, 98))
-        new_img = exposure.rescale_intensity(img, in_range=(p2, p98))
-        lab_img = rgb2lab(new_img)
-        lab_img[:, :, 0] = lab_img[:, :, 0]/100
-        lab_img[:, :, 1] = np.interp(lab_img[:, :, 1], (-128, 128), (0, 1))
-        lab_img[:, :, 2] = np.interp(lab_img[:, :, 2], (-128, 128), (0, 1))
-        #lab_img = np.expand_dims(lab_img[:, :, 0], axis=2)
-        print(lab_img.shape)
-        tiff.imsave(new_path_img+f, lab_img)
+        p2, p98 = block_percentiles(blocks, (2, 98), reader.dtype, dim_x * dim_y * n_bands)
+    tmp_path = '{}.{}.tmp'.format(new_path, os.getpid())
+    out = tiff.memmap(tmp_path, shape=(dim_x, dim_y, 3), dtype=np.dtype(dtype))
+    for x, block in zip(range(0, dim_x, block_rows), blocks()):
+        out[x:x + block_rows] = lab_block(block, p2, p98, dtype)
+    out.flush()
+    del out
+    reader.close()
+    os.replace(tmp_path, new_path)
+    return new_path
+
+
+if __name__ == '__main__':
+    # see preprocess.py for the parallel, non-interactive version
+    dataset = input('Potsdam (p) or Vaihingen (v) dataset? ')
+    while True:
+        if dataset == 'p':
+            path_img = '/home/mdias/datasets/potsdam/Images/'
+            new_path_img = '/home/mdias/datasets/potsdam/Images_lab_hist/'
+            break
+        elif dataset == 'v':
+            path_img = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Images/'
+            new_path_img = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Images_l_eq_hist/'
+            break
+        else:
+            dataset = input('p or v?')
+
+    if not os.path.exists(new_path_img): os.makedirs(new_path_img)
+    files = [f for f in listdir(path_img) if isfile(join(path_img, f))]
+    for f in tqdm(files):
+        if '.tif' in f:
+            lab_img = lab_image(tiff.imread(path_img+f), OUTPUT_DTYPE)
+            print(lab_img.shape)
+            tiff.imsave(new_path_img+f, lab_img)
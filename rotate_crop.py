@@ -4,6 +4,8 @@ import tifffile as tiff
 import math
 import numpy as np
 import cv2
+from palette import PALETTES, decode, one_hot
+from mask_format import NO_CLASS
 
 def rotate_image(image, angle):
     """
@@ -132,102 +134,78 @@ def crop_around_center(image, width, height):
 
     return image[y1:y2, x1:x2]
 
-def get_map(color_codes):
-  color_map = np.ndarray(shape=(256*256*256), dtype='int32')
-  color_map[:] = -1
-  for rgb, idx in color_codes.items():
-    rgb = rgb[0] * 65536 + rgb[1] * 256 + rgb[2]
-    color_map[rgb] = idx
-  return color_map
-
-def norm_image(image):
-    color_codes = {
-      (255, 255, 255): 1,   #imp surface
-      (255, 255, 0): 2,     #car
-      (0, 0, 255): 3,       #building
-      (255, 0, 0): 4,       #background
-      (0, 255, 255): 5,     #low veg
-      (0, 255, 0): 6        #tree
-    }
-
-    color_map = get_map(color_codes)
-
-    image = image.astype(int)
-    image = image.dot(np.array([65536, 256, 1], dtype='int32'))
-
-    new_a = color_map[image]
-    image_norm = (np.arange(new_a.max()) == new_a[...,None]-1).astype(int)
-    return image_norm
-
-dataset = input('Potsdam (p) or Vaihingen (v) dataset? ')
-while True:
-    if dataset == 'p':
-        path_img = '/home/mdias/datasets/potsdam/Images_l/'
-        new_path_img = '/home/mdias/datasets/potsdam/Images_l_rot_crop/'
-        path_mask = '/home/mdias/datasets/potsdam/Masks/'
-        new_path_mask = '/home/mdias/datasets/potsdam/Masks_rot_crop/'
-        break
-    elif dataset == 'v':
-        path_full_img = '/home/mdias/datasets/vaihingen/Images_lab_hist/'
-        path_img = '/home/mdias/datasets/vaihingen/Images_l/'
-        path_mask = '/home/mdias/datasets/vaihingen/Ground_Truth/'
-        new_path_mask = '/home/mdias/datasets/vaihingen/Masks/'
-        break
-    else:
-        dataset = input('p or v?')
-
+def norm_image(image, palette='potsdam'):
+    # one-hot of the classes of the RGB ground truth, the pixels of no class are all zeros
+    return one_hot(decode(image, palette), len(PALETTES[palette]))
 
-train_ids = ['1', '3', '11', '13', '15', '17', '21', '26', '28', '30', '32', '34']
-name_template = 'top_mosaic_09cm_area{}.tif'
-new_name_template = 'top_mosaic_09cm_area_rc_{}.tif'
+def index_image(image, palette='potsdam'):
+    # uint8 class index map of the RGB ground truth, NO_CLASS where the colour is of no class (mask_format.py)
+    classes = decode(image, palette)
+    return np.where(classes < 0, NO_CLASS, classes).astype('uint8')
 
-for f in train_ids:
-    full_image = tiff.imread(path_full_img + name_template.format(f))
-    image = tiff.imread(path_img + name_template.format(f))
-    mask = tiff.imread(path_mask + name_template.format(f))
+def rotate_crop(image, angle=45):
+    # rotates the image and crops the largest axis-aligned rectangle without filler
     image_height, image_width = image.shape[0:2]
-
-    image_orig = np.copy(image)
-    mask_orig = np.copy(mask)
-    full_image_orig = np.copy(full_image)
-
-    image_rotated = rotate_image(image, 45)
-    mask_rotated = rotate_image(mask, 45)
-    full_image_rotated = rotate_image(full_image, 45)
-
-    image_rotated_cropped = crop_around_center(
-        image_rotated,
-        *largest_rotated_rect(
-            image_width,
-            image_height,
-            math.radians(45)
-        )
-    )
-
-    mask_rotated_cropped = crop_around_center(
-        mask_rotated,
+    return crop_around_center(
+        rotate_image(image, angle),
         *largest_rotated_rect(
             image_width,
             image_height,
-            math.radians(45)
+            math.radians(angle)
         )
     )
 
-    full_image_rotated_cropped = crop_around_center(
-        full_image_rotated,
-        *largest_rotated_rect(
-            image_width,
-            image_height,
-            math.radians(45)
-        )
-    )
+def rotate_crop_images(full_image, image, mask, angle=45, mask_format='onehot'):
+    """
+    :param mask: RGB ground truth, returned one-hot by norm_image, or as a class index map by index_image with
+    mask_format='index'
+    :return: (full_image, image, mask) rotated and cropped
+    """
+    image_rotated_cropped = rotate_crop(image, angle)
+    mask_rotated_cropped = rotate_crop(mask, angle)
+    full_image_rotated_cropped = rotate_crop(full_image, angle)
 
     height, width = image_rotated_cropped.shape[0:2]
     image_rotated_cropped = image_rotated_cropped.reshape([height, width, 1])
 
-    height, width = mask_rotated_cropped.shape[0:2]
-    mask_rotated_cropped = norm_image(mask_rotated_cropped).astype('uint8')
-
-    tiff.imsave(path_img + new_name_template.format(f), image_rotated_cropped)
-    tiff.imsave(new_path_mask + new_name_template.format(f), mask_rotated_cropped)
-    tiff.imsave(path_full_img + new_name_template.format(f), full_image_rotated_cropped)
+    if mask_format == 'index':
+        mask_rotated_cropped = index_image(mask_rotated_cropped)
+    else:
+        mask_rotated_cropped = norm_image(mask_rotated_cropped).astype('uint8')
+    return full_image_rotated_cropped, image_rotated_cropped, mask_rotated_cropped
+
+if __name__ == '__main__':
+    # see preprocess.py for the parallel, non-interactive version
+    dataset = input('Potsdam (p) or Vaihingen (v) dataset? ')
+    while True:
+        if dataset == 'p':
+            path_img = '/home/mdias/datasets/potsdam/Images_l/'
+            new_path_img = '/home/mdias/datasets/potsdam/Images_l_rot_crop/'
+            path_mask = '/home/mdias/datasets/potsdam/Masks/'
+            new_path_mask = '/home/mdias/datasets/potsdam/Masks_rot_crop/'
+            break
+        elif dataset == 'v':
+            path_full_img = '/home/mdias/datasets/vaihingen/Images_lab_hist/'
+            path_img = '/home/mdias/datasets/vaihingen/Images_l/'
+            path_mask = '/home/mdias/datasets/vaihingen/Ground_Truth/'
+            new_path_mask = '/home/mdias/datasets/vaihingen/Masks/'
+            break
+        else:
+            dataset = input('p or v?')
+
+
+    train_ids = ['1', '3', '11', '13', '15', '17', '21', '26', '28', '30', '32', '34']
+    name_template = 'top_mosaic_09cm_area{}.tif'
+    new_name_template = 'top_mosaic_09cm_area_rc_{}.tif'
+
+    for f in train_ids:
+        full_image = tiff.imread(path_full_img + name_template.format(f))
+        image = tiff.imread(path_img + name_template.format(f))
+        mask = tiff.imread(path_mask + name_template.format(f))
+
+        full_image_rotated_cropped, image_rotated_cropped, mask_rotated_cropped = rotate_crop_images(full_image, image,
+                                                                                                    mask, 45)
+
+        tiff.imsave(path_img + new_name_template.format(f), image_rotated_cropped)
+        tiff.imsave(new_path_mask + new_name_template.format(f), mask_rotated_cropped)
+        tiff.imsave(path_full_img + new_name_template.format(f), full_image_rotated_cropped)
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def step_rng(seed, step):
+    # Philox is counter-based, the key (seed, step) gives the stream of the step without drawing the previous ones
+    return np.random.Generator(np.random.Philox(key=[seed, step]))
+
+
+class StepSampler(object):
+    """
+    Draws everything random of a training step from the step number alone: the tiles, the crop offsets and the D4
+    transformations of the patches. Workers drawing different steps never overlap, and training can resume at any step.
+    :param files_weights: probability of drawing each tile
+    :param per_patch: draw a tile per patch instead of one tile for the whole batch
+    :param class_sampler: class_index.ClassSampler drawing the crops with target class proportions, uniform crops if
+    None
+    :param hard_miner: hard_mining.HardExampleMiner drawing the tiles and crops by the losses of their regions instead
+    of files_weights, the batch of a step then also depends on the losses recorded before it
+    """
+
+    def __init__(self, files_weights, batch_size, seed=0, per_patch=False, augment=True, class_sampler=None,
+                 hard_miner=None):
+        if class_sampler is not None and hard_miner is not None:
+            raise ValueError('class_sampler and hard_miner cannot be used together')
+        self.files_weights = np.asarray(files_weights)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.per_patch = per_patch
+        self.augment = augment
+        self.class_sampler = class_sampler
+        self.hard_miner = hard_miner
+
+    def sample(self, step):
+        """
+        :return: (files, ux, uy, ks), the indices of the tiles of the patches, the crop offsets as fractions in [0, 1)
+        of the range of each tile (see gen_patches.crop_offsets) and the D4 transformations
+        """
+        rng = step_rng(self.seed, step)
+        n = self.batch_size
+        if self.hard_miner is not None:
+            files, ux, uy = self.hard_miner.sample(rng, n, self.per_patch)
+            ks = rng.integers(0, 8, n) if self.augment else np.zeros(n, dtype=int)
+            return files, ux, uy, ks
+        if self.per_patch:
+            files = rng.choice(len(self.files_weights), n, p=self.files_weights)
+        else:
+            files = np.repeat(rng.choice(len(self.files_weights), p=self.files_weights), n)
+        if self.class_sampler is not None:
+            ux, uy = self.class_sampler.sample(rng, files)
+        else:
+            ux = rng.random(n)
+            uy = rng.random(n)
+        ks = rng.integers(0, 8, n) if self.augment else np.zeros(n, dtype=int)
+        return files, ux, uy, ks
@@ -0,0 +1,129 @@
+import threading
+import time
+from queue import Queue
+import numpy as np
+from keras.callbacks import Callback
+from gen_patches import get_rand_batch
+from generator import get_input, get_mask, add_time
+from tile_cache import TileCache
+
+
+class DatasetSource(object):
+    """
+    Stream of decoded tiles of one dataset, drawn uniformly from its ids.
+    :param cache_bytes: budget of a TileCache of the decoded tiles, None decodes a tile every time it is drawn
+    :param prefetch: number of tiles decoded ahead by a background thread, 0 decodes them when they are asked for
+    :param reader: see generator.image_generator
+    """
+
+    def __init__(self, name, path_image, path_mask, path_full_img, ids, weight = 1., cache_bytes = None,
+                 cache_reuse = None, prefetch = 2, reader = 'tiff', seed = 0):
+        self.name = name
+        self.path_image = path_image
+        self.path_mask = path_mask
+        self.path_full_img = path_full_img
+        self.ids = ids
+        self.weight = weight
+        self.reader = reader
+        self.rng = np.random.RandomState(seed)
+        self.cache = None
+        if cache_bytes is not None:
+            self.cache = TileCache(self.load_tile, cache_bytes, cache_reuse)
+        self.queue = None
+        if prefetch > 0:
+            self.queue = Queue(maxsize = prefetch)
+            thread = threading.Thread(target = self._prefetch)
+            thread.daemon = True
+            thread.start()
+
+    def load_tile(self, id):
+        image = get_input(self.path_image.format(id), self.reader)
+        mask = get_mask(self.path_mask.format(id), self.reader)
+        full_img = get_input(self.path_full_img.format(id), self.reader)
+        return image, mask, full_img
+
+    def _draw_tile(self):
+        id = self.ids[self.rng.randint(len(self.ids))]
+        if self.cache is not None:
+            return self.cache.get(id)
+        return self.load_tile(id)
+
+    def _prefetch(self):
+        try:
+            while True:
+                self.queue.put(self._draw_tile())
+        except Exception as e:
+            # the exception goes to the consumer instead of a tile, next_tile raises it
+            self.queue.put(e)
+
+    def next_tile(self):
+        if self.queue is not None:
+            tile = self.queue.get()
+            if isinstance(tile, Exception):
+                # kept for the next calls, the thread is gone
+                self.queue.put(tile)
+                raise tile
+            return tile
+        return self._draw_tile()
+
+
+class StreamMixer(object):
+    """
+    Interleaves the patches of several DatasetSource into batches, each source being drawn with probability
+    proportional to its weight. The weights can be changed with set_weights while the generator is running.
+    :param per_patch: draw a source and a tile for every patch, otherwise the whole batch comes from one tile. None
+    draws per patch only when every source has a TileCache, without one each patch would decode a whole tile
+    """
+
+    def __init__(self, sources, batch_size = 5, patch_size = 160, per_patch = None, augment = True, seed = 0):
+        self.sources = sources
+        self.batch_size = batch_size
+        self.patch_size = patch_size
+        if per_patch is None:
+            per_patch = all(s.cache is not None for s in sources)
+        self.per_patch = per_patch
+        self.augment = augment
+        self.rng = np.random.RandomState(seed)
+        self.set_weights(dict((s.name, s.weight) for s in sources))
+
+    def set_weights(self, weights):
+        """
+        :param weights: dict from the name of the sources to their new weight, missing sources keep their weight
+        """
+        for source in self.sources:
+            source.weight = weights.get(source.name, source.weight)
+        p = np.array([s.weight for s in self.sources], dtype='float64')
+        # swapped in one assignment, the generator reads either the old or the new weights
+        self.p = p / p.sum()
+
+    def generator(self):
+        n_sources = len(self.sources)
+        while True:
+            p = self.p
+            if self.per_patch:
+                tiles = [self.sources[s].next_tile() for s in self.rng.choice(n_sources, self.batch_size, p=p)]
+            else:
+                tiles = [self.sources[self.rng.choice(n_sources, p=p)].next_tile()] * self.batch_size
+            start = time.perf_counter()
+            batch_x, batch_y, batch_y2 = get_rand_batch(tiles, self.patch_size, self.rng, self.augment)
+            add_time('crop', start)
+            yield (batch_x, [batch_y, batch_y2])
+
+
+class MixerWeights(Callback):
+    """
+    Changes the weights of a StreamMixer at the beginning of the epochs.
+    :param schedule: function taking the epoch and returning a dict of weights for StreamMixer.set_weights, or None to
+    keep the current ones
+    """
+
+    def __init__(self, mixer, schedule):
+        super(MixerWeights, self).__init__()
+        self.mixer = mixer
+        self.schedule = schedule
+
+    def on_epoch_begin(self, epoch, logs=None):
+        weights = self.schedule(epoch)
+        if weights is not None:
+            self.mixer.set_weights(weights)
+            print('\nmixer weights', dict((s.name, s.weight) for s in self.mixer.sources))
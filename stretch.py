@@ -0,0 +1,221 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# bins of the histogram locating the order statistics of float images
+N_BINS = 2 ** 16
+# rows read at a time by image_histogram
+BLOCK_ROWS = 512
+HIST_SUFFIX = '.hist.npz'
+
+
+def _ranks(n, q):
+    # ranks of the order statistics np.percentile interpolates between (method 'linear')
+    index = np.asarray(q, dtype='float64') / 100 * (n - 1)
+    return index, np.floor(index).astype('int64'), np.ceil(index).astype('int64')
+
+
+def _interpolate(index, lo, values_lo, values_hi):
+    # same operations as the linear interpolation of np.percentile, so the results are equal to the last bit
+    t = index - lo
+    diff = values_hi - values_lo
+    result = values_lo + diff * t
+    return np.where(t >= 0.5, values_hi - diff * (1 - t), result)
+
+
+def is_exact(dtype):
+    # 8 and 16 bit integer images get a bin for every value
+    return np.issubdtype(np.dtype(dtype), np.integer) and np.dtype(dtype).itemsize <= 2
+
+
+class Histogram(object):
+    """
+    Per-channel histograms of an image, built block by block with memory independent of the size of the image. The
+    histograms of several images or regions add up with merge, for the percentiles of a dataset or of a mosaic.
+    8 and 16 bit images get a bin per value and percentiles equal to np.percentile. Float images are binned in n_bins
+    bins over value_range, their percentiles are interpolated inside the bins.
+    """
+
+    def __init__(self, n_channels, dtype='uint8', value_range=None, n_bins=N_BINS):
+        self.dtype = np.dtype(dtype)
+        if is_exact(self.dtype):
+            info = np.iinfo(self.dtype)
+            self.value_range = (int(info.min), int(info.max) + 1)
+            n_bins = int(info.max) - int(info.min) + 1
+        elif value_range is None:
+            raise ValueError('value_range is needed for the histograms of {} images'.format(self.dtype))
+        else:
+            self.value_range = tuple(float(v) for v in value_range)
+        self.counts = np.zeros((n_channels, n_bins), dtype='int64')
+
+    def bins_of(self, values):
+        lo, hi = self.value_range
+        if is_exact(self.dtype):
+            return values.astype('int64') - lo
+        n_bins = self.counts.shape[1]
+        return np.clip(((values.astype('float64') - lo) * (n_bins / (hi - lo))).astype('int64'), 0, n_bins - 1)
+
+    def update(self, block):
+        """
+        :param block: ndarray with shape (x_sz, y_sz, num_channels), or (x_sz, y_sz) for one channel
+        """
+        block = np.asarray(block)
+        block = block.reshape(block.shape[0], block.shape[1], -1)
+        for c in range(self.counts.shape[0]):
+            self.counts[c] += np.bincount(self.bins_of(block[:, :, c].ravel()), minlength=self.counts.shape[1])
+        return self
+
+    def merge(self, other):
+        if other.value_range != self.value_range or other.counts.shape != self.counts.shape:
+            raise ValueError('histograms with different bins cannot be merged')
+        self.counts += other.counts
+        return self
+
+    def _order_statistics(self, counts, ranks):
+        cumulative = np.cumsum(counts)
+        bins = np.searchsorted(cumulative, ranks, side='right')
+        lo, hi = self.value_range
+        if is_exact(self.dtype):
+            return (bins + lo).astype('float64')
+        # the values of a bin taken as evenly spread over it
+        before = np.where(bins > 0, cumulative[np.maximum(bins - 1, 0)], 0)
+        inside = (ranks - before + 0.5) / counts[bins]
+        return lo + (bins + inside) * (hi - lo) / len(counts)
+
+    def percentiles(self, q, channel=None):
+        """
+        :param channel: percentiles of one channel, of all the values of the image as np.percentile(img, q) if None
+        """
+        counts = self.counts.sum(axis=0) if channel is None else self.counts[channel]
+        index, lo, hi = _ranks(counts.sum(), q)
+        values_lo = self._order_statistics(counts, lo.ravel()).reshape(lo.shape)
+        values_hi = self._order_statistics(counts, hi.ravel()).reshape(hi.shape)
+        return _interpolate(index, lo, values_lo, values_hi)
+
+    def save(self, path, **extra):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, counts=self.counts, dtype=self.dtype.str, value_range=self.value_range, **extra)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        hist = cls(data['counts'].shape[0], str(data['dtype']), tuple(data['value_range']), data['counts'].shape[1])
+        hist.counts[:] = data['counts']
+        return hist
+
+
+def percentiles(img, q):
+    # np.percentile(img, q), with a histogram instead of a sort for 8 and 16 bit images
+    img = np.asarray(img)
+    if not is_exact(img.dtype):
+        return np.percentile(img, q)
+    return Histogram(img.shape[2] if img.ndim > 2 else 1, img.dtype).update(img).percentiles(q)
+
+
+def hist_path(path):
+    return os.path.splitext(path)[0] + HIST_SUFFIX
+
+
+def image_histogram(path, value_range=None, n_bins=N_BINS, block_rows=BLOCK_ROWS, window=None):
+    """
+    Histogram of a tif read in blocks of rows, stored next to it and read back while the tif is unchanged.
+    :param window: (x0, y0, x_sz, y_sz), histogram of that region of the image only, not stored
+    """
+    from tiled_tiff import open_tiled
+    stat = os.stat(path)
+    if window is None and os.path.isfile(hist_path(path)):
+        stored = np.load(hist_path(path))
+        if stored['mtime'] == stat.st_mtime and stored['size'] == stat.st_size:
+            hist = Histogram.load(hist_path(path))
+            if value_range is None or hist.value_range == tuple(float(v) for v in value_range):
+                return hist
+    reader = open_tiled(path)
+    x0, y0, x_sz, y_sz = window or (0, 0) + reader.shape[:2]
+    x_end, y_end = min(x0 + x_sz, reader.shape[0]), min(y0 + y_sz, reader.shape[1])
+    hist = Histogram(reader.shape[2], reader.dtype, value_range, n_bins)
+    for x in range(x0, x_end, block_rows):
+        hist.update(reader[x:min(x + block_rows, x_end), y0:y_end])
+    reader.close()
+    if window is None:
+        hist.save(hist_path(path), mtime=stat.st_mtime, size=stat.st_size)
+    return hist
+
+
+def dataset_histogram(paths, value_range=None, n_workers=4, **kwargs):
+    """
+    Sum of the histograms of the tifs of paths, e.g. the tiles of a dataset or of a region, from the histograms
+    stored next to them when they are up to date.
+    """
+    with ThreadPoolExecutor(n_workers) as pool:
+        hists = list(pool.map(lambda p: image_histogram(p, value_range, **kwargs), paths))
+    total = hists[0]
+    for hist in hists[1:]:
+        total.merge(hist)
+    return total
+
+
+def _float_order_statistics(blocks, ranks):
+    # range of the values, histogram of the values in N_BINS bins, then exact selection inside the bins of the ranks
+    vmin, vmax = np.inf, -np.inf
+    for block in blocks():
+        vmin, vmax = min(vmin, np.min(block)), max(vmax, np.max(block))
+    if vmin == vmax:
+        return np.full(len(ranks), vmin)
+    scale = N_BINS / (float(vmax) - float(vmin))
+
+    def bins_of(values):
+        return np.minimum(((values.astype('float64') - vmin) * scale).astype('int64'), N_BINS - 1)
+
+    counts = np.zeros(N_BINS, dtype='int64')
+    for block in blocks():
+        counts += np.bincount(bins_of(np.asarray(block).ravel()), minlength=N_BINS)
+    cumulative = np.cumsum(counts)
+    bins = np.searchsorted(cumulative, ranks, side='right')
+    wanted = np.unique(bins)
+    inside = dict((b, []) for b in wanted)
+    for block in blocks():
+        values = np.asarray(block).ravel()
+        block_bins = bins_of(values)
+        for b in wanted:
+            inside[b].append(values[block_bins == b])
+    result = []
+    for rank, b in zip(ranks, bins):
+        values = np.sort(np.concatenate(inside[b]))
+        before = cumulative[b - 1] if b > 0 else 0
+        result.append(values[rank - before])
+    return np.array(result)
+
+
+def block_percentiles(blocks, q, dtype, size=None):
+    """
+    Exactly np.percentile(image, q) of an image read in blocks, without holding it in memory. 8 and 16 bit images take
+    one pass for a Histogram, the other images three passes.
+    :param blocks: function returning a new iterator over the blocks of the image at every call
+    :param q: percentiles, as for np.percentile
+    :param dtype: dtype of the image
+    :param size: number of values of the image, counted with one more pass if None
+    """
+    if is_exact(dtype):
+        hist = Histogram(1, dtype)
+        for block in blocks():
+            hist.update(np.asarray(block).reshape(-1, 1))
+        return hist.percentiles(q)
+    if size is None:
+        size = sum(np.asarray(block).size for block in blocks())
+    index, lo, hi = _ranks(size, q)
+    ranks = np.concatenate([lo.ravel(), hi.ravel()])
+    # np.percentile computes in the float dtype of the image, float64 for integer images
+    values = _float_order_statistics(blocks, ranks)
+    values = values.astype(dtype if np.issubdtype(np.dtype(dtype), np.floating) else 'float64')
+    return _interpolate(index, lo, values[:lo.size].reshape(lo.shape), values[lo.size:].reshape(lo.shape))
+
+
+if __name__ == '__main__':
+    # python stretch.py <tif> [<tif> ...], stores the histograms and prints the 2nd and 98th percentiles
+    for path in sys.argv[1:]:
+        print(path, image_histogram(path).percentiles((2, 98)))
+    if len(sys.argv) > 2:
+        print('dataset', dataset_histogram(sys.argv[1:]).percentiles((2, 98)))
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import threading
+
+
+class TileCache(object):
+    """
+    LRU cache of decoded tiles bounded by the number of bytes they hold in memory.
+    :param load_fn: function taking a tile id and returning a tuple of arrays (image, mask, full_img)
+    :param max_bytes: budget of the cached tiles, the least recently used ones are evicted first
+    :param reuse: number of patches a tile serves before it is evicted, None keeps it until the budget evicts it
+    """
+
+    def __init__(self, load_fn, max_bytes=4 * 1024 ** 3, reuse=None):
+        self.load_fn = load_fn
+        self.max_bytes = max_bytes
+        self.reuse = reuse
+        self.tiles = OrderedDict()
+        self.uses = dict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # tiles being decoded, by id
+        self.loading = dict()
+
+    def get(self, id):
+        # the tiles are decoded outside the lock, so a miss does not block the other threads. The threads asking for a
+        # tile being decoded wait for it instead of decoding it again
+        with self.lock:
+            if id in self.tiles:
+                self.hits += 1
+                self.tiles.move_to_end(id)
+                return self._use(id, self.tiles[id])
+            loading = self.loading.get(id)
+            if loading is None:
+                self.misses += 1
+                loading = self.loading[id] = {'done': threading.Event(), 'tile': None, 'error': None}
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if not owner:
+            loading['done'].wait()
+            if loading['error'] is not None:
+                raise loading['error']
+            with self.lock:
+                return self._use(id, loading['tile'])
+        try:
+            tile = self.load_fn(id)
+        except Exception as e:
+            with self.lock:
+                del self.loading[id]
+            loading['error'] = e
+            loading['done'].set()
+            raise
+        with self.lock:
+            del self.loading[id]
+            self.tiles[id] = tile
+            self.uses[id] = 0
+            self.nbytes += sum(a.nbytes for a in tile)
+            self._evict()
+            loading['tile'] = tile
+            loading['done'].set()
+            return self._use(id, tile)
+
+    def _use(self, id, tile):
+        # the tile may have been evicted by another thread since it was loaded, it is still returned
+        if id in self.uses:
+            self.uses[id] += 1
+            if self.reuse is not None and self.uses[id] >= self.reuse:
+                self._remove(id)
+        return tile
+
+    def _remove(self, id):
+        tile = self.tiles.pop(id)
+        del self.uses[id]
+        self.nbytes -= sum(a.nbytes for a in tile)
+        self.evictions += 1
+
+    def _evict(self):
+        # the newest tile is kept even if it does not fit in the budget alone
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            self._remove(next(iter(self.tiles)))
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(), 'evictions': self.evictions,
+                'tiles': len(self.tiles), 'bytes': self.nbytes}
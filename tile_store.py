@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+import tifffile as tiff
+from quantize import quantize
+
+
+def store_path(path):
+    # the memory-mappable copy lives next to the original tif
+    return os.path.splitext(path)[0] + '.npy'
+
+
+def convert_tile(path, overwrite=False, dtype=None):
+    """
+    Writes the decoded tif at path as an uncompressed .npy array that can be memory-mapped.
+    :param path: path of the tif tile
+    :param overwrite: rewrite the store even if it is newer than the tif
+    :param dtype: 'uint8' or 'float16' to store a quantized copy, see quantize.py
+    :return: path of the store
+    """
+    new_path = store_path(path)
+    if not overwrite and os.path.isfile(new_path) and os.path.getmtime(new_path) >= os.path.getmtime(path):
+        return new_path
+    img = tiff.imread(path)
+    if dtype is not None:
+        img = quantize(img, dtype)
+    tmp_path = new_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(img))
+    os.replace(tmp_path, new_path)
+    return new_path
+
+
+def convert_tiles(ids, *path_templates, **kwargs):
+    for path_template in path_templates:
+        for id in ids:
+            print(convert_tile(path_template.format(id), **kwargs))
+
+
+def open_tile(path):
+    # slicing the memmap only touches the pages of the crop, which stay in the OS page cache
+    return np.load(store_path(path), mmap_mode='r')
+
+
+if __name__ == '__main__':
+    # python tile_store.py <tif> [<tif> ...]
+    for path in sys.argv[1:]:
+        print(convert_tile(path))
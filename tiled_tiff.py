@@ -0,0 +1,151 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import numpy as np
+import tifffile as tiff
+
+TILE_SZ = 256
+N_THREADS = 4
+# subdirectory of the tiled copies, so the listings of the tifs of a dataset do not take them for new images
+TILED_DIR = 'tiled'
+
+_pool = None
+_pool_pid = None
+
+
+def get_pool():
+    # a process forked by batch_producer.py inherits the pool of its parent without its threads, so it builds its own
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ThreadPoolExecutor(N_THREADS)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def tiled_path(path):
+    # the tiled copy of dir/name.tif is dir/tiled/name.tif
+    directory, name = os.path.split(path)
+    return os.path.join(directory, TILED_DIR, name)
+
+
+def write_tiled(path, tile_sz=TILE_SZ, overwrite=False, **kwargs):
+    """
+    Rewrites the tif at path as an internally tiled tif (BigTIFF when it does not fit in 4 GB).
+    :param kwargs: passed to tiff.imwrite, e.g. the compression of the tiles
+    :return: path of the tiled tif
+    """
+    new_path = tiled_path(path)
+    if not overwrite and os.path.isfile(new_path) and os.path.getmtime(new_path) >= os.path.getmtime(path):
+        return new_path
+    img = tiff.imread(path)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    if img.ndim == 3 and img.shape[2] == 1:
+        img = img[:, :, 0]
+    if img.ndim == 3:
+        # one page with the channels as samples, otherwise masks with many classes are written as a stack of pages
+        kwargs.setdefault('photometric', 'minisblack')
+        kwargs.setdefault('planarconfig', 'contig')
+    tmp_path = new_path + '.tmp'
+    tiff.imwrite(tmp_path, img, tile=(tile_sz, tile_sz), bigtiff=img.nbytes > 2 ** 32 - 2 ** 25, **kwargs)
+    os.replace(tmp_path, new_path)
+    return new_path
+
+
+class TiledImage(object):
+    """
+    Reads windows of a tif without decoding the whole image. For tiled tifs only the tiles overlapping the window are
+    read, and they are decoded by a pool of threads. Other tifs are memory-mapped when possible, or decoded once.
+    Windows are indexed like the arrays, image[x0:x1, y0:y1] with x along the rows, and always have the shape
+    (x1 - x0, y1 - y0, n_channels). The parts of a window outside the image are zero, like the padding of
+    cv2.copyMakeBorder(..., cv2.BORDER_CONSTANT).
+    """
+    # holds no decoded pixels, see TileCache
+    nbytes = 0
+
+    def __init__(self, path):
+        self.tif = tiff.TiffFile(path)
+        series = self.tif.series[0]
+        self.page = series.pages[0]
+        page = self.page
+        self.shape = series.shape if len(series.shape) == 3 else series.shape + (1,)
+        self.dtype = series.dtype
+        self.lock = threading.Lock()
+        self.data = None
+        self.tiled = (len(series.pages) == 1 and page.is_tiled and page.planarconfig == 1 and page.imagedepth == 1 and
+                      self.shape == (page.imagelength, page.imagewidth, page.samplesperpixel))
+        if not self.tiled:
+            if page.is_memmappable:
+                self.data = series.asarray(out='memmap')
+            else:
+                self.data = series.asarray()
+            self.data = self.data.reshape(self.shape)
+        else:
+            self.tiles_across = (page.imagewidth + page.tilewidth - 1) // page.tilewidth
+
+    def close(self):
+        self.tif.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getitem__(self, key):
+        x_slice, y_slice = key[:2]
+        x0, x1 = x_slice.start or 0, x_slice.stop
+        y0, y1 = y_slice.start or 0, y_slice.stop
+        if x1 is None:
+            x1 = self.shape[0]
+        if y1 is None:
+            y1 = self.shape[1]
+        return self.read_window(x0, y0, x1 - x0, y1 - y0)
+
+    def read_window(self, x0, y0, height, width):
+        out = np.zeros((height, width, self.shape[2]), dtype=self.dtype)
+        # part of the window inside the image
+        ix0, iy0 = max(x0, 0), max(y0, 0)
+        ix1, iy1 = min(x0 + height, self.shape[0]), min(y0 + width, self.shape[1])
+        if ix0 >= ix1 or iy0 >= iy1:
+            return out
+        if not self.tiled:
+            out[ix0 - x0:ix1 - x0, iy0 - y0:iy1 - y0] = self.data[ix0:ix1, iy0:iy1]
+            return out
+
+        page = self.page
+        tl, tw = page.tilelength, page.tilewidth
+        indices = [r * self.tiles_across + c
+                   for r in range(ix0 // tl, (ix1 - 1) // tl + 1)
+                   for c in range(iy0 // tw, (iy1 - 1) // tw + 1)]
+        # the file handle is shared, so the raw tiles are read under the lock and only decoded in parallel
+        with self.lock:
+            fh = self.tif.filehandle
+            raw = []
+            for index in indices:
+                fh.seek(page.dataoffsets[index])
+                raw.append(fh.read(page.databytecounts[index]))
+        jpegtables = getattr(page, 'jpegtables', None)
+        tiles = get_pool().map(lambda args: page.decode(args[0], args[1], jpegtables=jpegtables)[0],
+                               zip(raw, indices))
+
+        for index, tile in zip(indices, tiles):
+            tile = tile.reshape(tl, tw, -1)
+            tx, ty = (index // self.tiles_across) * tl, (index % self.tiles_across) * tw
+            # overlap of the tile and the window, in image coordinates
+            ox0, ox1 = max(tx, ix0), min(tx + tl, ix1)
+            oy0, oy1 = max(ty, iy0), min(ty + tw, iy1)
+            out[ox0 - x0:ox1 - x0, oy0 - y0:oy1 - y0] = tile[ox0 - tx:ox1 - tx, oy0 - ty:oy1 - ty]
+        return out
+
+
+def open_tiled(path):
+    # falls back to the original tif when it was not rewritten by write_tiled
+    new_path = tiled_path(path)
+    return TiledImage(new_path if os.path.isfile(new_path) else path)
+
+
+if __name__ == '__main__':
+    # python tiled_tiff.py <tif> [<tif> ...]
+    for path in sys.argv[1:]:
+        print(write_tiled(path))
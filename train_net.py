@@ -3,6 +3,11 @@ from wnet_model import *
 from gen_mask_neighbor import *
 from gen_patches import *
 from generator import *
+from batch_producer import parallel_image_generator, parallel_val_generator, parallel_shard_val_generator
+from val_shards import shard_val_generator, INDEX_NAME
+from data_pipeline import build_dataset, dataset_generator
+from manifest import dataset_records
+from hard_mining import HardExampleMiner, HardExampleCallback
 from clr_callback import *
 import os.path
 import tensorflow as tf
@@ -38,6 +43,7 @@ if DATASET == 'potsdam':
     path_patch_img = '/home/mdias/datasets/potsdam/Images_l_patch/'
     path_patch_full_img = '/home/mdias/datasets/potsdam/Images_lab_hist_patch/'
     path_patch_mask = '/home/mdias/datasets/potsdam/Masks_patch/'
+    path_val_shards = '/home/mdias/datasets/potsdam/val_shards/'
     PATCH_SZ = 320  # should divide by 16
     VALIDATION_STEPS = 7873
     if MODEL == 'U':
@@ -62,6 +68,7 @@ elif DATASET == 'vaihingen':
     path_patch_img = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Images_l_patch/'
     path_patch_full_img = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Images_lab_hist_patch/'
     path_patch_mask = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/Masks_patch/'
+    path_val_shards = 'C:/Users/Utilizador/Documents/Dissertacao/datasets/vaihingen/val_shards/'
 
     PATCH_SZ = 320  # should divide by 16
     #BATCH_SIZE = 5
@@ -71,13 +78,57 @@ elif DATASET == 'vaihingen':
     VALIDATION_STEPS = 1369
     MAX_QUEUE = 10
 
+# 'mmap' crops from the .npy stores written by tile_store.py instead of decoding the whole tifs every step,
+# 'tiled' decodes only the tiles under the crops of the tifs written by tiled_tiff.py
+READER = 'tiff'
+# images preprocessed with OUTPUT_DTYPE = 'uint8' (rgb2lab.py, tile_store.py), scaled to [0, 1] by the model
+UINT8_INPUTS = False
+# D4 transformations drawn and applied by the model on the device, the generators only slice raw crops
+AUGMENT_IN_GRAPH = False
+# max brightness change of the inputs in the training phase, 0 disables it (W model only)
+BRIGHTNESS = 0.
+# 'tf.data' builds the training batches with the parallel tf.data pipeline of data_pipeline.py
+PIPELINE = 'generator'
+# processes building the batches, 1 keeps the single generator of the main process
+N_WORKERS = 1
+# bytes of decoded tiles kept in memory so batches mix patches of several tiles, None reads one tile per batch
+CACHE_BYTES = None
+CACHE_REUSE = 50
+# key of the sampler, with it a step always draws the same batch
+SEED = 0
+# step to resume a training from, the batches of the previous steps are not generated again
+INITIAL_STEP = 0
+# target proportion of each class in the patches, e.g. [1, 3, 1, 1, 1, 1] to oversample cars, None for uniform crops
+CLASS_WEIGHTS = None
+# format of the masks, 'index' for the uint8 class index maps written with --mask-format index by preprocess.py,
+# expanded to one-hot per batch (see mask_format.py)
+MASK_FORMAT = 'onehot'
+# soft labels within this many pixels of the class boundaries of the training patches, computed per batch by
+# gen_mask_neighbor.soft_boundary, None keeps the hard labels
+BOUNDARY_RADIUS = None
+# minimum fraction of valid pixels of the training crops, None keeps the crops over the filler of rotated tiles
+MIN_VALID = None
+# oversample the regions of the tiles with high losses, see hard_mining.py (single generator only, N_WORKERS = 1)
+HARD_MINING = False
+# softmax temperature of the losses of the regions, lower concentrates the patches on the hardest ones
+HARD_TEMPERATURE = 0.1
+# share of the patches drawn uniformly by area
+HARD_UNIFORM = 0.3
+# batches between two evaluations of the losses of the patches
+HARD_EVERY = 4
+# read the validation patches from the shards written by gen_validation.py, when they exist, instead of one tif per
+# patch
+VAL_SHARDS = os.path.isfile(os.path.join(path_val_shards, INDEX_NAME))
+# keep the shards in memory across epochs, memory-mapped otherwise
+VAL_RESIDENT = False
+
 
 def get_files_weights(path, train_ids):
+    # the shapes come from the manifest of the directory (manifest.py), the tiles are not decoded
     files_weights = []
     count_all = 0
-    for id in train_ids:
-        img = tiff.imread(path.format(id))
-        count = img.shape[0]*img.shape[1]
+    for record in dataset_records(path, train_ids):
+        count = record['shape'][0]*record['shape'][1]
         count_all+=count
         files_weights.append(count)
     files_weights = np.array(files_weights)
@@ -89,7 +140,8 @@ def get_model():
     if MODEL == 'U':
         model = unet_model(N_CLASSES, PATCH_SZ, n_channels=N_BANDS)
     elif MODEL == 'W':
-        model = wnet_model(N_CLASSES, PATCH_SZ, n_channels=N_BANDS)
+        model = wnet_model(N_CLASSES, PATCH_SZ, n_channels=N_BANDS, uint8_inputs=UINT8_INPUTS,
+                           augment=AUGMENT_IN_GRAPH, brightness=BRIGHTNESS)
     return model
 
 
@@ -112,17 +164,72 @@ if __name__ == '__main__':
         clr = CyclicLR(base_lr=10e-5, max_lr=10e-4, step_size=step_size, mode='triangular2')
 
         files_weights = get_files_weights(path_img, TRAIN_IDS)
-        train_gen = image_generator(TRAIN_IDS, path_img, path_mask, path_full_img, files_weights, batch_size = BATCH_SIZE, patch_size = PATCH_SZ)
-        val_gen = val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = BATCH_SIZE)
+        # refresh the manifests of the masks and full images as well, to fail early on a tile that does not match
+        for path in (path_mask, path_full_img):
+            for id, record, mask_record in zip(TRAIN_IDS, dataset_records(path_img, TRAIN_IDS),
+                                               dataset_records(path, TRAIN_IDS)):
+                if record['shape'][:2] != mask_record['shape'][:2]:
+                    raise ValueError('{} has shape {}, {} has {}'.format(path.format(id), mask_record['shape'],
+                                                                         path_img.format(id), record['shape']))
+        callbacks = [model_checkpoint, csv_logger, early_stopping, clr]
+        hard_miner = None
+        if HARD_MINING:
+            if N_WORKERS > 1 or PIPELINE == 'tf.data':
+                # the losses of the callback would not reach the samplers of the workers or of the dataset
+                raise ValueError('HARD_MINING needs PIPELINE = \'generator\' and N_WORKERS = 1')
+            hard_miner = HardExampleMiner([r['shape'] for r in dataset_records(path_img, TRAIN_IDS)], PATCH_SZ,
+                                          temperature = HARD_TEMPERATURE, uniform = HARD_UNIFORM)
+            callbacks.append(HardExampleCallback(hard_miner, HARD_EVERY))
+        if PIPELINE == 'tf.data':
+            train_dataset = build_dataset(TRAIN_IDS, path_img, path_mask, path_full_img, files_weights,
+                                          batch_size = BATCH_SIZE, patch_size = PATCH_SZ, reader = READER, seed = SEED,
+                                          initial_step = INITIAL_STEP, cache_bytes = CACHE_BYTES,
+                                          cache_reuse = CACHE_REUSE, augment = not AUGMENT_IN_GRAPH,
+                                          mask_format = MASK_FORMAT, n_classes = N_CLASSES,
+                                          class_weights = CLASS_WEIGHTS, min_valid = MIN_VALID,
+                                          boundary_radius = BOUNDARY_RADIUS)
+            train_gen = dataset_generator(train_dataset, sess)
+        elif N_WORKERS > 1:
+            train_gen = parallel_image_generator(TRAIN_IDS, path_img, path_mask, path_full_img, files_weights,
+                                                 batch_size = BATCH_SIZE, patch_size = PATCH_SZ, reader = READER,
+                                                 n_workers = N_WORKERS, cache_bytes = CACHE_BYTES,
+                                                 cache_reuse = CACHE_REUSE, seed = SEED, initial_step = INITIAL_STEP,
+                                                 class_weights = CLASS_WEIGHTS, augment = not AUGMENT_IN_GRAPH,
+                                                 min_valid = MIN_VALID, mask_format = MASK_FORMAT,
+                                                 n_classes = N_CLASSES, boundary_radius = BOUNDARY_RADIUS)
+        else:
+            train_gen = image_generator(TRAIN_IDS, path_img, path_mask, path_full_img, files_weights, batch_size = BATCH_SIZE, patch_size = PATCH_SZ,
+                                        reader = READER, cache_bytes = CACHE_BYTES, cache_reuse = CACHE_REUSE,
+                                        seed = SEED, initial_step = INITIAL_STEP, class_weights = CLASS_WEIGHTS,
+                                        augment = not AUGMENT_IN_GRAPH, hard_miner = hard_miner,
+                                        min_valid = MIN_VALID, mask_format = MASK_FORMAT, n_classes = N_CLASSES,
+                                        boundary_radius = BOUNDARY_RADIUS)
+        if N_WORKERS > 1:
+            if VAL_SHARDS:
+                val_gen = parallel_shard_val_generator(path_val_shards, batch_size = BATCH_SIZE,
+                                                       n_workers = N_WORKERS, mask_format = MASK_FORMAT,
+                                                       n_classes = N_CLASSES)
+            else:
+                val_gen = parallel_val_generator(path_patch_img, path_patch_full_img, path_patch_mask,
+                                                 batch_size = BATCH_SIZE, n_workers = N_WORKERS,
+                                                 mask_format = MASK_FORMAT, n_classes = N_CLASSES)
+        else:
+            if VAL_SHARDS:
+                val_gen = shard_val_generator(path_val_shards, batch_size = BATCH_SIZE, resident = VAL_RESIDENT,
+                                              mask_format = MASK_FORMAT, n_classes = N_CLASSES)
+            else:
+                val_gen = val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = BATCH_SIZE,
+                                        mask_format = MASK_FORMAT, n_classes = N_CLASSES)
         print('\n\n\n', (next(train_gen)[1][0]).shape, '\n\n\n')
 
         model.fit_generator(train_gen,
                             steps_per_epoch=STEPS_PER_EPOCH,
                             nb_epoch=N_EPOCHS,
+                            initial_epoch=INITIAL_STEP // STEPS_PER_EPOCH,
                             validation_data=val_gen,
                             validation_steps=VALIDATION_STEPS,
                             verbose=1, shuffle=True, max_queue_size=MAX_QUEUE,
-                            callbacks=[model_checkpoint, csv_logger, early_stopping, clr]
+                            callbacks=callbacks
                             )
 
         return model
@@ -1,6 +1,7 @@
 from unet_model import *
 from wnet_model import *
 from generator_dstl import *
+from data_pipeline import build_dataset, dataset_generator
 from clr_callback import *
 import os.path
 import tensorflow as tf
@@ -37,12 +38,17 @@ print('\n\n', len(TRAIN_IDS), len(VAL_IDS), '\n\n')
 path_img = path + 'images_lab/{}.tif'
 path_mask = path + 'mask_uni/{}.tif'
 
+# 'soft' for the uint8 fixed point masks written by bbox.py with MASK_FORMAT = 'soft'
+MASK_FORMAT = 'onehot'
+
 PATCH_SZ = 224  # should divide by 16
 VALIDATION_STEPS = 2000
 
 STEPS_PER_EPOCH = 8000
 BATCH_SIZE = 12
 MAX_QUEUE = 30
+# 'tf.data' builds the training batches with the parallel tf.data pipeline of data_pipeline.py
+PIPELINE = 'generator'
 
 
 def get_model():
@@ -70,9 +76,16 @@ if __name__ == '__main__':
         step_size = (STEPS_PER_EPOCH // BATCH_SIZE) * 8
         #clr = CyclicLR(base_lr=10e-5, max_lr=10e-4, step_size=step_size, mode='triangular2')
 
-        train_gen = image_generator(TRAIN_IDS, path_img, path_mask, path_img, batch_size = BATCH_SIZE, patch_size = PATCH_SZ)
+        if PIPELINE == 'tf.data':
+            files_weights = np.ones(len(TRAIN_IDS)) / len(TRAIN_IDS)
+            train_gen = dataset_generator(build_dataset(TRAIN_IDS, path_img, path_mask, path_img, files_weights,
+                                                        batch_size = BATCH_SIZE, patch_size = PATCH_SZ,
+                                                        mask_format = MASK_FORMAT, n_classes = N_CLASSES), sess)
+        else:
+            train_gen = image_generator(TRAIN_IDS, path_img, path_mask, path_img, batch_size = BATCH_SIZE, patch_size = PATCH_SZ,
+                                        mask_format = MASK_FORMAT, n_classes = N_CLASSES)
         val_gen = image_generator(VAL_IDS, path_img, path_mask, path_img, batch_size=BATCH_SIZE,
-                                    patch_size=PATCH_SZ)
+                                    patch_size=PATCH_SZ, mask_format = MASK_FORMAT, n_classes = N_CLASSES)
         #val_gen = val_generator(path_patch_img, path_patch_full_img, path_patch_mask, batch_size = BATCH_SIZE)
 
         model.fit_generator(train_gen,
@@ -0,0 +1,71 @@
+import json
+import os
+from os.path import join
+import numpy as np
+from mask_format import expand
+
+# arrays of a validation patch, in the order of the batches (batch_x, [batch_y, batch_y2])
+TARGETS = ('img', 'mask', 'full_img')
+INDEX_NAME = 'index.json'
+
+
+def shard_path(path_shards, target, id):
+    return join(path_shards, '{}_{}.npy'.format(target, id))
+
+
+def write_shard(path_shards, target, id, patches):
+    """
+    Writes the patches of one image as a single contiguous array, patch i starts at i * patches[0].nbytes.
+    :param patches: ndarray with shape (n_patches, sz, sz, num_channels)
+    """
+    new_path = shard_path(path_shards, target, id)
+    tmp_path = new_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(patches))
+    os.replace(tmp_path, new_path)
+
+
+def write_index(path_shards, ids):
+    # number of patches of every shard, the offset of a patch in the validation set is the sum of the previous counts
+    counts = [len(np.load(shard_path(path_shards, TARGETS[0], id), mmap_mode='r')) for id in ids]
+    with open(join(path_shards, INDEX_NAME), 'w') as f:
+        json.dump({'ids': list(ids), 'counts': counts}, f)
+
+
+def load_index(path_shards):
+    with open(join(path_shards, INDEX_NAME)) as f:
+        return json.load(f)
+
+
+def shard_val_generator(path_shards, batch_size = 5, resident = False, shard = 0, n_shards = 1, mask_format = 'onehot',
+                        n_classes = None):
+    """
+    Streams the validation patches of the shards sequentially, looping over them forever.
+    :param resident: load the shards in memory once instead of memory-mapping them, they stay there across epochs
+    :param shard: with n_shards, the part of the validation set read by this generator (see batch_producer.py)
+    :param mask_format: format of the mask patches, expanded to n_classes planes per batch (see mask_format.py)
+    """
+    index = load_index(path_shards)
+    mmap_mode = None if resident else 'r'
+    arrays = [[np.load(shard_path(path_shards, target, id), mmap_mode=mmap_mode) for id in index['ids']]
+              for target in TARGETS]
+    offsets = np.cumsum([0] + index['counts'])
+    total = offsets[-1]
+    start, stop = total * shard // n_shards, total * (shard + 1) // n_shards
+    if start == stop:
+        raise ValueError('shard {} of {} has no patch, the validation set has {} patches'.format(shard, n_shards,
+                                                                                                total))
+
+    patch = start
+    while True:
+        batch = [np.empty((batch_size,) + a[0].shape[1:], dtype=a[0].dtype) for a in arrays]
+        for i in range(batch_size):
+            s = np.searchsorted(offsets, patch, side='right') - 1
+            for target_arrays, out in zip(arrays, batch):
+                out[i] = target_arrays[s][patch - offsets[s]]
+            patch += 1
+            if patch == stop:
+                patch = start
+        batch_x, batch_y, batch_y2 = batch
+        batch_y = expand(batch_y, n_classes, mask_format)
+        yield (batch_x, [batch_y, batch_y2])
@@ -7,6 +7,7 @@ from keras.initializers import he_uniform
 from keras import losses
 from lovasz_losses_tf import *
 from loss import *
+from augment import RandomD4, D4Transform, BrightnessJitter
 
 
 def swish(x):
@@ -55,13 +56,32 @@ def conv2_super_block(input_tensor, n_filters, init_seed=None):
     return conv2d_compress_block(concatenate([x, y, input_tensor]), n_filters, init_seed=init_seed)
 
 
-def wnet_model(n_classes=7, im_sz=160, n_channels=3, n_filters_start=32, growth_factor=2, droprate=0.5, init_seed=None):
-    inputs = Input((im_sz, im_sz, 3))
+def wnet_model(n_classes=7, im_sz=160, n_channels=3, n_filters_start=32, growth_factor=2, droprate=0.5, init_seed=None,
+               uint8_inputs=False, augment=False, brightness=0.):
+    """
+    :param augment: draw a random D4 transformation per sample in the graph, applied to the inputs in the training
+    phase and undone on both outputs, so the targets are compared untransformed and the loader only has to slice raw
+    crops (generator.image_generator with augment=False). The layers have no weights, the saved weights load into a
+    model built without them.
+    :param brightness: max_delta of a BrightnessJitter of the inputs in the training phase, 0 disables it
+    """
+    if uint8_inputs:
+        # images and full image targets quantized to uint8 (see quantize.py), scaled to [0, 1] in the graph
+        inputs = Input((im_sz, im_sz, 3), dtype='uint8')
+        scaled_inputs = Lambda(lambda x: K.cast(x, 'float32') / 255.)(inputs)
+    else:
+        inputs = Input((im_sz, im_sz, 3))
+        scaled_inputs = inputs
+    if brightness > 0:
+        scaled_inputs = BrightnessJitter(brightness)(scaled_inputs)
+    if augment:
+        ks = RandomD4()(scaled_inputs)
+        scaled_inputs = D4Transform()([scaled_inputs, ks])
 
     # -------------Encoder
     # Block1
     n_filters = n_filters_start
-    actv1 = conv2_super_block(inputs, n_filters, init_seed=init_seed)
+    actv1 = conv2_super_block(scaled_inputs, n_filters, init_seed=init_seed)
     pool1 = MaxPooling2D(pool_size=(2, 2))(actv1)
 
     # Block2
@@ -262,10 +282,15 @@ def wnet_model(n_classes=7, im_sz=160, n_channels=3, n_filters_start=32, growth_
     conv19 = Conv2D(n_channels, (1, 1), activation='sigmoid', name = 'output2')(conv18)
 
     output2 = conv19
+    if augment:
+        output1 = D4Transform(inverse=True)([output1, ks])
+        output2 = D4Transform(inverse=True)([output2, ks])
 
     model = Model(inputs=inputs, outputs=[output1, output2])
 
     def mean_squared_error(y_true, y_pred):
+        if uint8_inputs:
+            y_true = y_true / 255.
         y_true_f = K.flatten(y_true)
         y_pred_f = K.flatten(y_pred)
         return K.mean(K.square(y_pred_f - y_true_f))